@@ -11,6 +11,9 @@ import fosof_qol as qol
 import sys
 import os
 import pandas as pd
+import numpy as np
+import collections
+import json
 import time
 import logging
 import traceback as tb
@@ -343,3 +346,155 @@ class Acquisition(object):
         sys.stderr.restore()
 
         return
+
+class RecordBuffer(object):
+    ''' A table the acquisitions fill one row at a time (one row per trace).
+    Each column is a numpy array of a fixed dtype, given in dtypes by column
+    name (float64 if not given, use object for strings). The arrays double in
+    size when they are full, so appending a row takes the same time however
+    long the run is. flush_to appends the rows added since the last flush to
+    a csv file, e.g. data.txt, and to the binary copy if there is one (see
+    open_sidecar).
+    '''
+
+    def __init__(self, columns, dtypes = None, capacity = 1024):
+        if dtypes is None:
+            dtypes = {}
+
+        for column in dtypes:
+            if not column in columns:
+                raise qol.Travisty("Oops! " + str(column) + \
+                                   " is not a column.")
+
+        self.columns = list(columns)
+        self.dtypes = [np.dtype(dtypes.get(c, np.float64)) \
+                       for c in self.columns]
+        self.capacity = max(int(capacity), 1)
+        self.arrays = [np.empty(self.capacity, dtype = d) for d in self.dtypes]
+        self.length = 0
+        self.flushed = 0
+        self.sidecar = None
+
+    def __len__(self):
+        return self.length
+
+    def append(self, row):
+        ''' Adds a row, given as a sequence of values in column order.'''
+
+        if len(row) != len(self.columns):
+            raise qol.Travisty("Oops! Got " + str(len(row)) + \
+                               " values for " + str(len(self.columns)) + \
+                               " columns.")
+
+        if self.length == self.capacity:
+            self.capacity *= 2
+            for i in range(len(self.arrays)):
+                array = np.empty(self.capacity, dtype = self.dtypes[i])
+                array[:self.length] = self.arrays[i][:self.length]
+                self.arrays[i] = array
+
+        for array, value in zip(self.arrays, row):
+            array[self.length] = value
+        self.length += 1
+
+    def column(self, name):
+        ''' Returns the values of a column so far (a view, not a copy).'''
+
+        return self.arrays[self.columns.index(name)][:self.length]
+
+    def to_frame(self, start = 0, stop = None):
+        ''' Returns rows start to stop as a DataFrame.'''
+
+        if stop is None:
+            stop = self.length
+
+        data = collections.OrderedDict((c, a[start:stop]) for c, a \
+                                       in zip(self.columns, self.arrays))
+
+        return pd.DataFrame(data, columns = self.columns)
+
+    def open_sidecar(self, folder, run_dictionary = None, string_width = 64):
+        ''' Keeps a binary copy of the table in folder, which fosof_qol.
+        load_data_columns can memory-map. Each column is appended to a file
+        of its own, with a fixed dtype. Strings are stored with a fixed width
+        of string_width bytes, and a longer one raises a Travisty when it is
+        written. schema.json has the column names, dtypes and
+        files, and the run dictionary (a dict, saved as strings).
+        '''
+
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+        self.sidecar = folder
+        self.sidecar_dtypes = []
+        for d in self.dtypes:
+            if d.kind in 'OSU':
+                self.sidecar_dtypes.append(np.dtype('S' + str(string_width)))
+            else:
+                self.sidecar_dtypes.append(d.newbyteorder('<'))
+        self.sidecar_files = ['%03d.col' % i for i in range(len(self.columns))]
+
+        if run_dictionary is None:
+            run_dictionary = {}
+
+        schema = {'columns' : [{'name' : c, 'dtype' : d.str, 'file' : f} \
+                               for c, d, f in zip(self.columns,
+                                                  self.sidecar_dtypes,
+                                                  self.sidecar_files)],
+                  'run dictionary' : dict((str(k), str(v)) for k, v \
+                                          in run_dictionary.items())}
+        with open(os.path.join(folder, 'schema.json'), 'w') as f:
+            json.dump(schema, f, indent = 1)
+
+        # Start the column files with the rows flushed so far
+        for f in self.sidecar_files:
+            open(os.path.join(folder, f), 'wb').close()
+        self._append_sidecar(0, self.flushed)
+
+    def _append_sidecar(self, start, stop):
+        # All columns are converted before any is written, so a string that
+        # does not fit leaves the files with the same number of rows
+        columns = []
+        for name, array, dtype in zip(self.columns, self.arrays,
+                                      self.sidecar_dtypes):
+            values = np.asarray(array[start:stop])
+            if dtype.kind == 'S':
+                values = values.astype(str)
+                if values.dtype.itemsize > dtype.itemsize:
+                    raise qol.Travisty("Oops! A value in " + name + " is " + \
+                                       str(values.dtype.itemsize) + \
+                                       " characters long, more than the " + \
+                                       str(dtype.itemsize) + " of the " + \
+                                       "sidecar. Open it with a larger " + \
+                                       "string_width.")
+            columns.append(values.astype(dtype))
+
+        for values, f in zip(columns, self.sidecar_files):
+            with open(os.path.join(self.sidecar, f), 'ab') as col_file:
+                col_file.write(values.tostring())
+
+    def write_header(self, f):
+        ''' Writes the column names to f, a file or a filename.'''
+
+        self._write(f, self.to_frame(0, 0), True)
+
+    def flush_to(self, f):
+        ''' Appends the rows added since the last flush to f, a file or a
+        filename. Returns the number of rows written.
+        '''
+
+        # The sidecar goes first, since it can refuse rows (see open_sidecar)
+        start = self.flushed
+        if self.sidecar is not None:
+            self._append_sidecar(start, self.length)
+        self._write(f, self.to_frame(start, self.length), False)
+        self.flushed = self.length
+
+        return self.length - start
+
+    def _write(self, f, frame, header):
+        if isinstance(f, basestring):
+            with open(f, 'a') as data_file:
+                frame.to_csv(data_file, header = header, index = False)
+        else:
+            frame.to_csv(f, header = header, index = False)
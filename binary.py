@@ -1,5 +1,12 @@
-import binascii, struct, array, os
+import binascii, struct, array, os, re, glob, fnmatch
+from multiprocessing.pool import ThreadPool
 import numpy as np
+import pandas as pd
+import tracearchive
+
+class Travisty(Exception):
+    def __init__(self, msg):
+        self.message = msg
 
 def txt_to_bin(text, encoding='utf-8', errors='surrogatepass'):
     bits = bin(int(binascii.hexlify(text.encode(encoding, errors)), 16))[2:]
@@ -62,3 +69,145 @@ def bin_digir(filename):
     f.close()
     
     return binary_array
+
+# Parts of a trace name made by FOSOFAcquisition.make_filename, e.g.
+# r001a002f0000910.0of625Bx-1.5chA_910on_01
+_TRACE_NAME_ = re.compile(r'^r(?P<rep>\d+)a(?P<avg>\d+)f(?P<freq>[\d.]+)' + \
+                          r'(?:of(?P<offset_freq>-?\d+))?' + \
+                          r'(?:B(?P<b_axis>[xy])(?P<b>-?[\d.]+))?' + \
+                          r'ch(?P<config>[AB])' + \
+                          r'(?:_910(?P<pre910>on|off))?' + \
+                          r'_0(?P<channel>\d)$')
+
+def parse_name(filename):
+    ''' Returns the trace name of a .npy trace file.'''
+
+    name = os.path.basename(filename)
+    for ext in ['.npy', '.digi']:
+        if name.endswith(ext):
+            name = name[:-len(ext)]
+
+    return name
+
+def parse_trace_name(name):
+    ''' Returns a dict with the repeat, average, carrier frequency [MHz],
+    offset frequency [Hz], magnetic field axis and value [Gauss],
+    configuration, 910 state and channel in a trace name made by
+    FOSOFAcquisition.make_filename. Parts that are not in the name are None.
+    Returns None if the name does not have this form.
+    '''
+
+    name = parse_name(name)
+    match = _TRACE_NAME_.match(name)
+    if match is None:
+        return None
+
+    info = match.groupdict()
+    for key, dtype in [('rep', int), ('avg', int), ('freq', float),
+                       ('offset_freq', int), ('b', float), ('channel', int)]:
+        if info[key] is not None:
+            info[key] = dtype(info[key])
+    info['name'] = name
+
+    return info
+
+def load_traces(path, pattern = '*', num_threads = 8):
+    ''' Loads many traces at once for analysis. path is a run's binary folder,
+    a trace archive (see tracearchive.py) or a glob of .npy files, e.g.
+    'D:/Binary Traces/run/*_01.digi.npy'. In a folder, the traces are read
+    from the archive traces.trc if there is one, otherwise from the .npy
+    files. Only traces whose names match the glob pattern are loaded, e.g.
+    pattern = '*_910off_01'.
+
+    The traces are read on num_threads threads, each straight into its row of
+    the result, and the .npy files are memory-mapped. Returns a 2D array with
+    one trace per row and a DataFrame with the parsed name of each trace (see
+    parse_trace_name) and the file it came from. All traces must have the same
+    length.
+    '''
+
+    archive = None
+    if os.path.isdir(path):
+        if os.path.exists(os.path.join(path, 'traces.trc')):
+            archive = os.path.join(path, 'traces.trc')
+        else:
+            files = glob.glob(os.path.join(path, '*.npy'))
+    elif path.endswith('.trc'):
+        archive = path
+    else:
+        files = glob.glob(path)
+
+    pool = ThreadPool(num_threads)
+    try:
+        if archive is not None:
+            trc = tracearchive.TraceArchive(archive)
+            names = list(trc.index['name'])
+            keep = [i for i in range(len(names)) \
+                    if fnmatch.fnmatch(names[i], pattern)]
+            sources = [archive] * len(keep)
+            names = [names[i] for i in keep]
+            read = lambda i: trc.trace(keep[i])
+
+            # The lengths of raw traces are in the index. A compressed trace's
+            # length is only known once it is decoded, so the first one is
+            # decoded here and the others are checked as they are copied.
+            index = trc.index[keep]
+            lengths = set(int(n) // 2 for n in \
+                          index['nbytes'][index['codec'] == ''])
+            compressed = np.nonzero(index['codec'] != '')[0]
+            if len(compressed) > 0:
+                lengths.add(len(read(compressed[0])))
+            dtype = np.dtype('<i2')
+        else:
+            files = sorted(f for f in files \
+                           if fnmatch.fnmatch(parse_name(f), pattern))
+            sources = files
+            names = [parse_name(f) for f in files]
+            read = lambda i: np.load(files[i], mmap_mode = 'r')
+
+            # Only the .npy headers are read here
+            def header(i):
+                V = read(i)
+                return len(V), V.dtype
+            headers = pool.map(header, range(len(files)))
+
+            lengths = set(n for n, d in headers)
+            dtype = headers[0][1] if headers else np.dtype('i2')
+
+        if len(lengths) > 1:
+            raise Travisty("Oops! The traces have different lengths " + \
+                           str(sorted(lengths)) + ". Use pattern to " + \
+                           "select traces of one length.")
+
+        if len(names) == 0:
+            data = np.zeros((0, 0), dtype = np.dtype('i2'))
+        else:
+            data = np.empty((len(names), lengths.pop()), dtype = dtype)
+
+        # Each trace is decoded or read straight into its row
+        def copy(i):
+            V = read(i)
+            if len(V) != data.shape[1]:
+                raise Travisty("Oops! Trace " + names[i] + " has " + \
+                               str(len(V)) + " samples, not " + \
+                               str(data.shape[1]) + ". Use pattern to " + \
+                               "select traces of one length.")
+            data[i] = V
+        pool.map(copy, range(len(names)))
+    finally:
+        pool.close()
+        pool.join()
+
+    meta = []
+    for name, source in zip(names, sources):
+        info = parse_trace_name(name)
+        if info is None:
+            info = {'name' : name}
+        info['file'] = source
+        meta.append(info)
+
+    columns = ['name', 'rep', 'avg', 'freq', 'offset_freq', 'b_axis', 'b',
+               'config', 'pre910', 'channel', 'file']
+    meta = pd.DataFrame(meta, columns = columns)
+
+    return data, meta
@@ -13,6 +13,7 @@ import numpy as np
 import matplotlib.pyplot as plt
 from datetime import datetime as dt
 import os
+from acquisition import RecordBuffer
 
 def main():
     # Data collection parameters
@@ -34,7 +35,10 @@ def main():
                          '0 Hz Frequency Component (AM On) [V]',
                          'Noise at AM Modulation Frequency [V]',
                          '0 Hz Frequency Component (AM Off) [V]']
-    dataframe = pd.DataFrame(columns = dataframe_columns)
+    dataframe = RecordBuffer(dataframe_columns,
+                             dtypes = {'Repeat' : int,
+                                       'Average' : int,
+                                       'AM Modulation Frequency [Hz]' : int})
 
     # Connect to generator and digitizer
     gen = generator.Generator(calib=True, b_on = False)
@@ -80,17 +84,15 @@ def main():
                                   dc_on,
                                   amplitude_off,
                                   dc_off]
-                dataframe = dataframe.append(pd.Series(data_to_append,
-                                                       index = dataframe_columns),
-                                             ignore_index=True)
+                dataframe.append(data_to_append)
 
     gen.power_low('A')
     gen.close()
 
     digi.close()
 
-    dataframe = dataframe.set_index(dataframe_columns[:3])
-    dataframe.to_csv(folder + '/data.csv')
+    dataframe.write_header(folder + '/data.csv')
+    dataframe.flush_to(folder + '/data.csv')
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
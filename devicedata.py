@@ -0,0 +1,105 @@
+''' Access to the device settings files in C:/DEVICEDATA/. The instrument
+modules used to read these files with pd.read_csv when they were imported,
+which slowed down the manager, every acquisition process and every reload,
+and made an import fail if a file was missing. Here a file is only read the
+first time one of its values is needed. The parsed table is kept and only read
+again if the file is modified (its modification time or size changes).
+'''
+import os
+import threading
+import pandas as pd
+
+_DEFAULT_FILE_LOCATION_ = "C:/DEVICEDATA/"
+
+# (file path, index column) -> ((mtime, size), table)
+_tables = {}
+
+# name -> table used instead of the file (see set_table)
+_overrides = {}
+
+_lock = threading.Lock()
+
+def get_table(name, index_col = None):
+    ''' Returns the table in the settings file name.csv, with index_col as the
+    index if given. The table is shared by all callers and must not be
+    modified. Use the copy method to get a table that can be.
+    '''
+
+    if name in _overrides:
+        table = _overrides[name]
+        if index_col is not None:
+            table = table.set_index(index_col)
+        return table
+
+    path = _DEFAULT_FILE_LOCATION_ + name + ".csv"
+    st = os.stat(path)
+    stamp = (st.st_mtime, st.st_size)
+
+    with _lock:
+        cached = _tables.get((path, index_col))
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+
+        table = pd.read_csv(path)
+        if index_col is not None:
+            table = table.set_index(index_col)
+
+        _tables[(path, index_col)] = (stamp, table)
+
+    return table
+
+def get_value(name, column, dtype = None, row = 0):
+    ''' Returns the value in the given column and row of the settings file
+    name.csv, converted with dtype (e.g. int or float) if given.
+    '''
+
+    value = get_table(name)[column].values[row]
+
+    if dtype is not None:
+        value = dtype(value)
+
+    return value
+
+def set_table(name, table):
+    ''' Uses the DataFrame table instead of the file name.csv from now on, e.g.
+    to work with simulated instruments on a computer without the device data
+    files. Set table to None to go back to the file.
+    '''
+
+    with _lock:
+        if table is None:
+            _overrides.pop(name, None)
+        else:
+            _overrides[name] = table
+
+def exists(name):
+    ''' Returns True if the settings file name.csv exists or was replaced
+    with set_table.
+    '''
+
+    return name in _overrides or \
+           os.path.exists(_DEFAULT_FILE_LOCATION_ + name + ".csv")
+
+def clear_cache():
+    ''' Forgets all loaded tables.'''
+
+    with _lock:
+        _tables.clear()
+
+class Settings(object):
+    ''' The first row of a settings file. Values are looked up like in a dict,
+    e.g. Settings('paths')['Data'], and the file is read on first access.
+    '''
+
+    def __init__(self, name):
+        self.name = name
+
+    def __getitem__(self, column):
+        return get_value(self.name, column)
+
+    def __contains__(self, column):
+        return column in get_table(self.name).columns
+
+    def get(self, column, dtype = None):
+        ''' Returns the value of the column, converted with dtype if given.'''
+        return get_value(self.name, column, dtype = dtype)
@@ -18,17 +18,19 @@ import pandas as pd
 import numpy as np
 import pylab as plt
 import time
+from multiprocessing.pool import ThreadPool
 import binary as b
+import devicedata
 
-_DEFAULT_FILE_LOCATION_ = "C:/DEVICEDATA/"
-info_file = pd.read_csv(_DEFAULT_FILE_LOCATION_ + 'digitizer.csv')
-addr_A = info_file['Address A'].ix[0]
-addr_B = info_file['Address B'].ix[0]
-ch_range = int(info_file['Channel Range'].ix[0])
-s_rate = int(info_file['Sampling Rate'].ix[0])
-n_samps = int(info_file['Number of Samples'].ix[0])
-trig_ch = int(info_file['Trigger Channel'].ix[0])
-t_out = int(info_file['Timeout'].ix[0])
+# Default settings, read from C:/DEVICEDATA/digitizer.csv when first needed
+info_file = devicedata.Settings('digitizer')
+
+# ADC code of a full scale reading. A 16 bit reading V is V*range/ADC_FULL_SCALE
+# volts.
+ADC_FULL_SCALE = 32767
+
+# Statistics that read_reduce can compute
+REDUCERS = ['mean', 'std', 'fourier']
 
 # The following methods make sure there are no errors in the given digitizer
 # settings
@@ -68,6 +70,18 @@ def is_numsamples(nsamp):
 
     return False
 
+def is_numrecords(nrec, nsamp):
+    ''' Checks to see if the given number of records is an int that can be
+    used by the digitizer with nsamp samples per record. All records of an
+    acquisition must fit in the 32MSa memory of each channel.
+    '''
+
+    if isinstance(nrec, int):
+        if nrec >= 1 and nrec * nsamp <= 32e6:
+            return True
+
+    return False
+
 def is_trigch(trigch):
     ''' Check if the given trigger channel is valid. Select 1 or 2 for CH1 or
     CH2, respectively. The user can also select 0 to trigger from the computer.
@@ -79,6 +93,25 @@ def is_trigch(trigch):
 
     return False
 
+def deinterleave(data, num_channels = 2, dtype = 'i2'):
+    ''' Separates the channels of an interleaved digitizer payload without
+    copying it. The raw bytes (sample 1 of CH1, sample 1 of CH2, sample 2 of
+    CH1, ...) are viewed as a 2D array of shape (samples, num_channels) and a
+    strided view of each column is returned, in channel order. Any trailing
+    bytes that do not make up a complete sample for every channel are ignored.
+
+    The returned arrays share memory with data. Use np.ascontiguousarray on a
+    channel if a packed copy is needed.
+    '''
+
+    dtype = np.dtype(dtype)
+    count = len(data) // (dtype.itemsize * num_channels) * num_channels
+
+    V = np.frombuffer(data, dtype = dtype, count = count)
+    V = V.reshape((-1, num_channels))
+
+    return [V[:,i] for i in range(num_channels)]
+
 class Travisty(Exception):
     def __init__(self, msg):
         self.message = msg
@@ -93,23 +126,50 @@ class Digitizer:
     purpose of having default settings stored somewhere.
     '''
 
-    def __init__(self, address, timeOut = t_out, ch1_range = ch_range, \
-                 ch2_range = ch_range, sampling_rate = s_rate, \
-                 num_samples = n_samps, trigger_channel = trig_ch,
-                 clocked = True):
-        ''' Error check provided values and initialize a Digitizer object.'''
+    def __init__(self, address, timeOut = None, ch1_range = None, \
+                 ch2_range = None, sampling_rate = None, \
+                 num_samples = None, trigger_channel = None,
+                 clocked = True, num_buffers = 0, resource_manager = None):
+        ''' Error check provided values and initialize a Digitizer object.
+        Settings left as None take the default from digitizer.csv. If
+        num_buffers is greater than 0, traces are read into a ring of that
+        many preallocated buffers (see set_buffers). A resource manager other
+        than the VISA one can be given, e.g. fakedigitizer.FakeResourceManager
+        to work with a simulated digitizer.
+        '''
+
+        if timeOut is None:
+            timeOut = info_file.get('Timeout', int)
+        if ch1_range is None:
+            ch1_range = info_file.get('Channel Range', int)
+        if ch2_range is None:
+            ch2_range = info_file.get('Channel Range', int)
+        if sampling_rate is None:
+            sampling_rate = info_file.get('Sampling Rate', int)
+        if num_samples is None:
+            num_samples = info_file.get('Number of Samples', int)
+        if trigger_channel is None:
+            trigger_channel = info_file.get('Trigger Channel', int)
 
         # Must use pyVISA because of the driver for the digitizer. It does not
         # create a virtual COM port.
-        rm = visa.ResourceManager()
-
-        # Select the proper address
-        if address == 'A':
-            self.device = rm.open_resource(addr_A, timeout = timeOut)
-        elif address == 'B':
-            self.device = rm.open_resource(addr_B, timeout = timeOut)
+        if resource_manager is None:
+            rm = visa.ResourceManager()
         else:
-            raise Travisty("Incorrect channel specified. Must be A or B.")
+            rm = resource_manager
+
+        # Select the proper address. Digitizers are named by a letter with an
+        # 'Address <letter>' column in digitizer.csv (A and B so far), or can
+        # be given by VISA resource name.
+        if 'Address ' + str(address) in info_file:
+            self.device = rm.open_resource(info_file['Address ' + str(address)],
+                                           timeout = timeOut)
+        elif '::' in str(address):
+            self.device = rm.open_resource(address, timeout = timeOut)
+        else:
+            raise Travisty("Incorrect digitizer specified. Must be A, B " + \
+                           "or another letter with an address in " + \
+                           "digitizer.csv.")
 
         # Query the digitizer for an ID and clear the buffer.
         self.name = self.device.query("*idn?")
@@ -124,8 +184,10 @@ class Digitizer:
         self.device.write("CONFigure:ACQuisition:SRATe " + \
                           `self._sampling_rate`)
 
-        # Make sure there is only one record per acquisition. Consecutive
-        # records must be triggered one after another.
+        # Start with one record per acquisition. Consecutive records must be
+        # triggered one after another. See set_numrecords for block
+        # acquisitions.
+        self._num_records = 1
         self.device.write("CONF:ACQ:RECords 1")
 
         # Check and set number of samples
@@ -181,6 +243,21 @@ class Digitizer:
             # Set the digitizer in the continuous time stamping mode.
             self.device.write("CONF:TRIG:TIM CONT")
 
+        self.set_buffers(num_buffers)
+
+        # Thread for background fetches. Started on the first call to
+        # fetch_async.
+        self._io_pool = None
+
+        # Bookkeeping for the setters (see get_config_savings)
+        self._num_skipped_writes = 0
+        self._config_time_saved = 0.0
+
+        # Bookkeeping for wait_for_acquisition
+        self._t_init = None
+        self._num_waits = 0
+        self._margin_saved = 0.0
+
     def sync(self, type):
         ''' Sync the digitizer to begin acquisition when a signal is received on
         the external trigger. If the type is 'master', emit the signal when the
@@ -233,26 +310,219 @@ class Digitizer:
 
         self.device.write("INITIATE")
 
+        # Sets the OPC bit of the event status register once the acquisition
+        # is complete. See wait_for_acquisition.
+        self.device.write("*OPC")
+        self._t_init = time.time()
+
+    def wait_for_acquisition(self, timeout = 10.0, min_poll = 0.001,
+                             max_poll = 0.05):
+        ''' Waits until the acquisition started by initialize is complete,
+        instead of sleeping for the trace length plus a fixed margin. The
+        record cannot be ready before the trace length has passed, so the
+        method sleeps until then. It then polls the OPC bit of the event status
+        register, starting with min_poll seconds between polls and doubling up
+        to max_poll. Raises a Travisty if the acquisition is not complete
+        timeout seconds after the trace should have ended.
+
+        Every wait adds the part of the old 0.100 s margin that was not needed
+        to a running total (see get_margin_saved).
+        '''
+
+        if self._t_init is None:
+            raise Travisty("Oops! No acquisition has been initialized.")
+
+        trace_length = self._num_records*self._num_samples/self._sampling_rate
+        t_end = self._t_init + trace_length
+        t_now = time.time()
+        if t_now < t_end:
+            time.sleep(t_end - t_now)
+
+        poll = min_poll
+        while not int(self.device.query("*ESR?")) & 1:
+            if time.time() - t_end > timeout:
+                raise Travisty("Oops! Timed out waiting for the acquisition " + \
+                               "to complete.")
+            time.sleep(poll)
+            poll = min(2 * poll, max_poll)
+
+        self._num_waits += 1
+        self._margin_saved += t_end + 0.100 - time.time()
+
+        # Reading *ESR? cleared the OPC bit, so a second wait needs a new
+        # initialize
+        self._t_init = None
+
+        return True
+
+    def get_margin_saved(self):
+        ''' Returns the number of waits done by wait_for_acquisition and the
+        total time [s] they saved compared to the old fixed margin.
+        '''
+
+        return self._num_waits, self._margin_saved
+
+    def fetch_async(self, wait = 0, poll = False, **kwargs):
+        ''' Reads the digitizer in a background thread. The thread sleeps for
+        wait seconds (e.g. the trace length after initialize), or calls
+        wait_for_acquisition if poll is True, and then calls read with the
+        keyword arguments given. Returns a
+        multiprocessing.pool.AsyncResult. Its get method blocks until the read
+        is done and returns what read returns, or raises what read raised.
+
+        Each digitizer has its own I/O thread, so the reads of several
+        digitizers run at the same time. The device must not be used from any
+        other thread until the result is ready.
+        '''
+
+        if self._io_pool is None:
+            self._io_pool = ThreadPool(1)
+
+        return self._io_pool.apply_async(self._delayed_read, (wait, poll),
+                                         kwargs)
+
+    def _delayed_read(self, wait, poll, **kwargs):
+        ''' Waits and reads. Run in the I/O thread by fetch_async.'''
+
+        if poll:
+            self.wait_for_acquisition()
+        elif wait > 0:
+            time.sleep(wait)
+
+        return self.read(**kwargs)
+
+    def set_buffers(self, num_buffers):
+        ''' Sets the number of preallocated buffers that traces are read into.
+        The buffers are used one after the other in a ring, and each one is
+        allocated on first use and grown only when a larger trace is read
+        (more samples or the FLOAT type). With num_buffers = 0, every read
+        allocates new memory as before.
+
+        When the buffers are in use, the arrays returned by read are views into
+        a buffer. They are only valid until num_buffers more reads have been
+        done, so they must be saved or copied before then.
+        '''
+
+        if not isinstance(num_buffers, int) or num_buffers < 0:
+            raise Travisty("Oops! Number of buffers must be an int >= 0.")
+
+        self._buffers = [None] * num_buffers
+        self._buffer_index = 0
+
+        return True
+
+    def _get_buffer(self, size):
+        ''' Returns a bytearray of at least size bytes to read a block into:
+        the next buffer of the ring if buffers are in use, otherwise a new
+        one.
+        '''
+
+        if len(self._buffers) == 0:
+            return bytearray(size)
+
+        i = self._buffer_index
+        self._buffer_index = (i + 1) % len(self._buffers)
+
+        if self._buffers[i] is None or len(self._buffers[i]) < size:
+            self._buffers[i] = bytearray(size)
+
+        return self._buffers[i]
+
+    def _read_block(self, sample_size = 1):
+        ''' Reads an IEEE 488.2 definite length block (#, the number of
+        digits d, d digits giving the payload length, the payload and a
+        terminator) from the digitizer. The payload is streamed in chunks of
+        device.chunk_size bytes straight into its destination buffer (see
+        _get_buffer), so no intermediate copy of the whole response is made.
+
+        Returns a uint8 array viewing the payload and an error flag. The flag
+        is 1 if fewer bytes arrived than the header announced, or if they do
+        not make up a whole number of samples of sample_size bytes. The data
+        is then cut to whole samples and the byte counts are written to
+        stderr.
+        '''
+
+        more = pyvisa.constants.StatusCode.success_max_count_read
+        read = self.device.visalib.read
+        session = self.device.session
+        chunk_size = self.device.chunk_size
+
+        with self.device.ignore_warning(pyvisa.constants.VI_SUCCESS_DEV_NPRESENT,
+                                        pyvisa.constants.VI_SUCCESS_MAX_CNT):
+            # Header
+            head, status = read(session, chunk_size)
+            while status == more and len(head) < 2:
+                chunk, status = read(session, chunk_size)
+                head += chunk
+
+            if head[0:1] != b'#' or not head[1:2].isdigit():
+                raise Travisty("Oops! Digitizer response is not a data " + \
+                               "block: " + repr(head[:40]))
+
+            while status == more and len(head) < 2 + int(head[1:2]):
+                chunk, status = read(session, chunk_size)
+                head += chunk
+
+            num_digits = int(head[1:2])
+            if num_digits == 0:
+                raise Travisty("Oops! Indefinite length blocks are not " + \
+                               "supported.")
+
+            if len(head) < 2 + num_digits or \
+               not head[2:2+num_digits].isdigit():
+                raise Travisty("Oops! Digitizer response has an incomplete " + \
+                               "block header: " + repr(head[:40]))
+
+            length = int(head[2:2+num_digits])
+            start = 2 + num_digits
+
+            # Payload
+            dest = self._get_buffer(length)
+            payload = head[start:start+length]
+            dest[:len(payload)] = payload
+            pos = len(payload)
+
+            while status == more and pos < length:
+                chunk, status = read(session, min(chunk_size, length - pos))
+                dest[pos:pos+len(chunk)] = chunk
+                pos += len(chunk)
+
+            # Terminator
+            while status == more:
+                chunk, status = read(session, chunk_size)
+
+        err = 0
+        if pos < length or pos % sample_size != 0:
+            err = 1
+            sys.stderr.write("Digitizer transfer incomplete: received " + \
+                             str(pos) + " of " + str(length) + " bytes, " + \
+                             str(pos % sample_size) + " trailing bytes " + \
+                             "discarded.\n")
+
+        return np.frombuffer(dest, dtype = np.uint8,
+                             count = pos - pos % sample_size), err
+
     def read(self, channel = None, read_type = 'INT', ret_bin = True,
              ret_split = True):
         ''' Reads the waveform voltage from the digitizer. These will be
         returned as numpy arrays of 64-bit floats or 16-bit integers, or binary
         numbers (depending on the return_bin and read_type params). Note that
-        the method read_raw collects the data as binary values. This is
-        necessary to avoid errors from the digitizer when the channel range is
-        not high enough for the FLOAT type.
+        the data is collected as binary values. This is necessary to avoid
+        errors from the digitizer when the channel range is not high enough
+        for the FLOAT type.
+
+        If more than one record per acquisition has been set (see
+        set_numrecords), non-binary data is returned with one row per record.
 
-        This function error checks the data and throws away any trailing bits
-        that are not enough to make a 64-bit number. This may result in some
-        lost data. As a result, an error code is also returned. If 0, no bits
-        were lost. Otherwise, will return 1.
+        The data block is checked against the length in its header (see
+        _read_block). If bytes are missing, or are not enough to make a whole
+        sample, an error code of 1 is returned along with the complete samples.
+        Otherwise, the error code is 0.
 
         Tested the timing. It takes 0.180 s to read two channels of data that
         have 1e5 samples.
         '''
 
-        err = 0 # Error flag
-
         if read_type == 'INT':
             dt = 'i2'
             cmd = 'ADC'
@@ -264,90 +534,169 @@ class Digitizer:
         else:
             raise Travisty('Invalid read type. Must be INT or FLOAT.')
 
+        if channel == None:
+            chans = "(@1, 2)"
+        elif channel == 1 or channel == 2:
+            chans = "(@" + str(channel) + ")"
+        else:
+            raise Travisty("Oops! Invalid channel selected. Must be 1 or 2.")
+
+        t_s = time.time()
+        self.device.write("FETCH:WAVeform:" + cmd + "? " + chans)
+        V, err = self._read_block(sample_size = n)
+        print(time.time()-t_s)
+
         # Return data from both channels
         if channel == None:
-            # Read the digitizer traces together in raw format:
-            # Characters 0 to 10: header containing number of samples to expect
-            # Characters 11 through N+11: Data (alternating channels)
-            # Character N+12: newline character
-            t_s = time.time()
-            self.device.write("FETCH:WAVeform:" + cmd + "? (@1, 2)")
-            data = self.device.read_raw(size = n*2*self._num_samples + 100)
-            print(time.time()-t_s)
-
-            header = data[:11]
-
-            # Error check
-            t_s = time.time()
-            if len(data[11:-1]) % n == 0:
-                V = data[11:-1]
-            else:
-                err = 1
-                extra = len(data[11:-1]) % n
-                V = data[11:-(extra+1)]
-            print(time.time()-t_s)
-
-            t_s = time.time()
-            # Separate channel data
+            # Separate channel data. The channels are strided views into the
+            # raw buffer. The binary form is a packed copy of each channel,
+            # which holds the same bytes the old character-by-character split
+            # produced.
             if ret_split:
-                V = np.array(list(V)).reshape((self._num_samples,n*2))
-                V1 = V[:,:n].flatten()
-                V2 = V[:,n:2*n].flatten()
-                print("To split")
-                print(time.time()-t_s)
-
-            # Convert to non-binary
-            if ret_split and not ret_bin:
-                V1 = np.frombuffer(V1, dtype = np.dtype(dt))
-                V2 = np.frombuffer(V2, dtype = np.dtype(dt))
-            elif not ret_bin:
-                V = np.frombuffer(V, dtype = np.dtype(dt))
+                V1, V2 = deinterleave(V, num_channels = 2, dtype = dt)
+                if ret_bin:
+                    V1 = np.ascontiguousarray(V1)
+                    V2 = np.ascontiguousarray(V2)
+                else:
+                    V1 = self._split_records(V1)
+                    V2 = self._split_records(V2)
 
-            if ret_split:
                 return V1, V2, err
-            else:
-                return V, err
-
-        elif channel == 1:
-            self.device.write("FETCH:WAVeform:" + cmd + "? (@1)")
-            data = self.device.read_raw(size = n*self._num_samples + 100)
-
-            header = data[:11]
-
-            if len(data[11:-1]) % n == 0:
-                V = data[11:-1]
-            else:
-                err = 1
-                extra = len(data[11:-1]) % n
-                V = data[11:-(extra+1)]
 
             if not ret_bin:
                 V = np.frombuffer(V, dtype = np.dtype(dt))
 
             return V, err
 
-        elif channel == 2:
-            self.device.write("FETCH:WAVeform:" + cmd + "? (@2)")
-            data = self.device.read_raw(size = n*self._num_samples + 100)
+        # Return data from one channel
+        if not ret_bin:
+            V = np.frombuffer(V, dtype = np.dtype(dt))
+            V = self._split_records(V)
 
-            header = data[:11]
+        return V, err
 
-            if len(data[11:-1]) % n == 0:
-                V = data[11:-1]
-            else:
-                err = 1
-                extra = len(data[11:-1]) % n
-                V = data[11:-(extra+1)]
+    def _split_records(self, V):
+        ''' Reshapes the data of one channel to (records, samples) if more
+        than one record per acquisition has been set. The result is a view.
+        '''
 
-            if not ret_bin:
-                V = np.frombuffer(V, dtype = np.dtype(dt))
+        if self._num_records > 1:
+            return V.reshape((self._num_records, -1))
+
+        return V
+
+    def read_reduce(self, reducers = ('mean', 'std'), channel = None,
+                    freqs = None, chunk_size = 16384):
+        ''' Reads the waveform as 16-bit integers and returns only the
+        statistics named in reducers, in volts:
+            'mean' - average of the trace
+            'std' - standard deviation of the trace (as np.std)
+            'fourier' - amplitude and phase at each frequency in freqs [Hz],
+                        as returned by fosof_qol.fit
+
+        This transfers a quarter of the bytes of a FLOAT read. The integers are
+        converted to floating point chunk_size samples at a time, and the
+        cosines and sines of the fourier reducer are made for each chunk as
+        well, so apart from the block read the memory used does not depend on
+        the number of samples.
+
+        Each channel gives a dict keyed by 'mean', 'std', 'amplitude' and
+        'phase' (the last two have one value per frequency). If more than one
+        record per acquisition has been set, every value has one row per
+        record. Returns R1, R2, err for both channels, or R, err for one
+        channel (see read for err).
+        '''
 
-            return V, err
+        for r in reducers:
+            if not r in REDUCERS:
+                raise Travisty("Oops! Unknown reducer " + str(r) + \
+                               ". Must be one of " + ", ".join(REDUCERS) + ".")
+
+        fourier = 'fourier' in reducers
+        if fourier:
+            if freqs is None:
+                raise Travisty("Oops! The fourier reducer needs frequencies.")
+            freqs = np.atleast_1d(np.asarray(freqs, dtype = float))
+
+        if channel == None:
+            chans = [1, 2]
+        elif channel == 1 or channel == 2:
+            chans = [channel]
         else:
             raise Travisty("Oops! Invalid channel selected. Must be 1 or 2.")
 
+        V, err = self.read(channel = channel, read_type = 'INT',
+                           ret_bin = True, ret_split = False)
+
+        # View the block as (records, samples, channels) without copying
+        nchan = len(chans)
+        nrec = self._num_records
+        nsamp = len(V) // (2 * nchan * nrec)
+        V = np.frombuffer(V, dtype = np.dtype('i2'),
+                          count = nrec * nsamp * nchan)
+        V = V.reshape((nrec, nsamp, nchan))
+
+        # Sums are taken about the first sample, which keeps the sum of
+        # squares exact for the std
+        V0 = V[:,0,:].astype(np.float64)
+        s = np.zeros((nrec, nchan))
+        s2 = np.zeros((nrec, nchan))
+
+        # Projections on cos(omega t) and sin(omega t), with the time axis of
+        # fosof_qol.fit
+        if fourier:
+            wdt = 2. * np.pi * freqs / self._sampling_rate
+            P = np.zeros((nrec, nchan, 2 * len(freqs)))
+
+        step = max(1, chunk_size // nrec)
+        for i in range(0, nsamp, step):
+            x = V[:,i:i + step,:].astype(np.float64)
+
+            x0 = x - V0[:,np.newaxis,:]
+            s += x0.sum(axis = 1)
+            s2 += (x0 * x0).sum(axis = 1)
+
+            if fourier:
+                wt = np.outer(np.arange(i, i + x.shape[1]), wdt)
+                basis = np.concatenate((np.cos(wt), np.sin(wt)), axis = 1)
+                P += np.tensordot(x, basis, axes = ([1], [0]))
+
+        # Only the final values are scaled to volts
+        scale = np.array([self.get_chrange(ch) for ch in chans]) / \
+                ADC_FULL_SCALE
+
+        results = {}
+        if 'mean' in reducers:
+            results['mean'] = (V0 + s / nsamp) * scale
+        if 'std' in reducers:
+            var = np.maximum(s2 / nsamp - (s / nsamp)**2, 0.)
+            results['std'] = np.sqrt(var) * scale
+        if fourier:
+            P *= 2. / nsamp
+            a = P[:,:,:len(freqs)]
+            b = P[:,:,len(freqs):]
+            results['amplitude'] = np.sqrt(a**2 + b**2) * \
+                                   scale[np.newaxis,:,np.newaxis]
+            results['phase'] = (np.arctan2(b, a) + 2. * np.pi) % (2. * np.pi)
+
+        R = []
+        for j in range(nchan):
+            Rj = {}
+            for key in results:
+                Rj[key] = results[key][:,j]
+                if nrec == 1:
+                    Rj[key] = Rj[key][0]
+                    if np.ndim(Rj[key]) == 0:
+                        Rj[key] = float(Rj[key])
+            R.append(Rj)
+
+        if channel == None:
+            return R[0], R[1], err
+
+        return R[0], err
+
     def read_save(self, f_names, channel = None, read_type = 'INT',
-                  ret = False, ret_bin = False):
+                  ret = False, ret_bin = False, writer = None):
         ''' Reads the data from the digitizer and saves the binary conversion to
         a file specified in f_names. INT will convert to 16-bit binary integer,
         while FLOAT will convert to 64-bit binary floating point value. If ret
@@ -355,6 +704,11 @@ class Digitizer:
         will return the data as binary. If both are True, data is returned as
         binary to save time.
 
+        If a trace archive writer is given (e.g. a
+        tracearchive.AsyncTraceWriter), INT traces are appended to it under
+        the names in f_names instead of being saved to .npy files. With the
+        AsyncTraceWriter, this returns before the traces are on the disk.
+
         Tested the timing. It takes 0.184 s to read and save two channels of
         data that have 1e5 samples.
 
@@ -368,69 +722,90 @@ class Digitizer:
 
         # Return data from both channels
         if channel == None:
+            # The channels come back as views into the fetched buffer, so they
+            # are written to disk without being split into separate copies
+            # first.
             V1, V2, err = self.read(channel = channel, read_type = read_type,
-                                    ret_bin = True)
+                                    ret_bin = False)
 
             # Save to files
-            np.save(f_names[0], np.frombuffer(V1, dtype = np.dtype(dt)))
-            np.save(f_names[1], np.frombuffer(V2, dtype = np.dtype(dt)))
-
-            if ret and not ret_bin:
-                # Separate channel data and return
-                V1 = np.frombuffer(V1[:len(V1)-len(V1) % n],
-                                   dtype = np.dtype(dt))
-                V2 = np.frombuffer(V2[:len(V2)-len(V2) % n],
-                                   dtype = np.dtype(dt))
-            elif ret_bin: pass
-            else: return err
+            self._save(f_names[0], V1, 1, read_type, writer)
+            self._save(f_names[1], V2, 2, read_type, writer)
+
+            if ret_bin:
+                V1 = np.ascontiguousarray(V1)
+                V2 = np.ascontiguousarray(V2)
+            elif not ret:
+                return err
 
             return V1, V2, err
 
         elif channel == 1 or channel == 2:
 
             V, err = self.read(channel = channel, read_type = read_type,
-                               ret_bin = True)
+                               ret_bin = False)
 
             # Save to files
-            np.save(f_names[0], np.frombuffer(V, dtype = np.dtype(dt)))
+            self._save(f_names[0], V, channel, read_type, writer)
 
-            if ret and not ret_bin:
-                # Convert to float or int
-                V = np.frombuffer(V, dtype = np.dtype(dt))
-            elif ret_bin: pass
-            else: return err
+            if not ret and not ret_bin:
+                return err
 
             return V, err
         else:
             raise Travisty("Oops! Invalid channel selected. Must be 1 or 2.")
 
+    def _save(self, f_name, V, channel, read_type, writer):
+        ''' Saves one channel for read_save.'''
+
+        if writer is None:
+            np.save(f_name, V)
+        elif read_type == 'INT':
+            writer.append(V, name = f_name, channel = channel)
+        else:
+            raise Travisty("Oops! Only INT traces can be saved to a trace " + \
+                           "archive.")
+
     def ini_read(self, channel = None, read_type = 'INT', ret_bin = True):
         ''' Initializes, waits and returns digitizer data.'''
 
         self.initialize()
-        time.sleep(self._num_samples/self._sampling_rate + 0.100)
+        self.wait_for_acquisition()
         return self.read(channel = channel,
                          read_type = read_type,
                          ret_bin = ret_bin)
 
+    def ini_read_reduce(self, reducers = ('mean', 'std'), channel = None,
+                        freqs = None):
+        ''' Initializes, waits and returns statistics of the digitizer data
+        (see read_reduce).
+        '''
+
+        self.initialize()
+        self.wait_for_acquisition()
+        return self.read_reduce(reducers = reducers,
+                                channel = channel,
+                                freqs = freqs)
+
     def ini_read_save(self, f_names, channel = None, read_type = 'INT', \
-                      ret = False, ret_bin = False):
+                      ret = False, ret_bin = False, writer = None):
         ''' Initializes, waits, saves and possibly returns data.'''
 
         self.initialize()
-        time.sleep(self._num_samples/self._sampling_rate + 0.100)
+        self.wait_for_acquisition()
         return self.read_save(f_names,
                               channel = channel,
                               read_type = read_type,
                               ret = ret,
-                              ret_bin = ret_bin)
+                              ret_bin = ret_bin,
+                              writer = writer)
 
     def get_chrange(self, chnum):
         ''' Returns the range of the digitizer channel specified.'''
         if chnum == 1:
-            return self.__ch1_range
+            return self._ch1_range
         elif chnum == 2:
-            return self.__ch2_range
+            return self._ch2_range
         else:
             raise Travisty("Oops! Can't find range for specified channel.")
 
@@ -442,6 +817,36 @@ class Digitizer:
         ''' Returns the number of samples per acquisition for the digitizer.'''
         return self._num_samples
 
+    def get_numrecords(self):
+        ''' Returns the number of records per acquisition for the digitizer.'''
+        return self._num_records
+
+    def get_config_savings(self):
+        ''' Returns the number of setter calls that were skipped because the
+        setting was already in place, and the total time [s] saved by the
+        setters compared to always writing and sleeping 0.25 s.
+        '''
+
+        return self._num_skipped_writes, self._config_time_saved
+
+    def _configure(self, cmd):
+        ''' Writes a configuration command and waits until the digitizer has
+        applied it, instead of sleeping for a fixed 0.25 s.
+        '''
+
+        t_s = time.time()
+        self.device.write(cmd)
+        self.device.query("*OPC?")
+        self._config_time_saved += 0.25 - (time.time() - t_s)
+
+    def _skip_configure(self):
+        ''' Counts a setter call that did not need to change anything.'''
+
+        self._num_skipped_writes += 1
+        self._config_time_saved += 0.25
+
+    # Setters. The private attributes hold the configured state of the
+    # digitizer, so setting a value it already has does not talk to it.
     def set_chrange(self, chnum, rng):
         ''' Sets the voltage range of the specified channel to rng, if it is
         an appropriate value.
@@ -451,28 +856,36 @@ class Digitizer:
             raise Travisty("Oops! Incompatible digitizer range.")
 
         if chnum == 1:
+            if rng == self._ch1_range:
+                self._skip_configure()
+                return True
             self._ch1_range = rng
-            self.device.write("CONF:CHANnel:RANGe (@1), " + str(self._ch1_range))
+            self._configure("CONF:CHANnel:RANGe (@1), " + str(self._ch1_range))
         elif chnum == 2:
+            if rng == self._ch2_range:
+                self._skip_configure()
+                return True
             self._ch2_range = rng
-            self.device.write("CONF:CHANnel:RANGe (@2), " + str(self._ch2_range))
+            self._configure("CONF:CHANnel:RANGe (@2), " + str(self._ch2_range))
         else:
             raise Travisty("Oops! Incorrect channel specified.")
 
-        time.sleep(0.25)
         return True
 
-    # Setters
     def set_samplingrate(self, srt):
         ''' Sets the sampling rate of the digitizer if appropriate.'''
 
         if not is_samplingrate(srt):
-            raise Travis("Oops! Incompatible sampling rate.")
+            raise Travisty("Oops! Incompatible sampling rate.")
+
+        if srt == self._sampling_rate:
+            self._skip_configure()
+            return True
 
         self._sampling_rate = srt
-        self.device.write("CONFigure:ACQuisition:SRATe " + str(int(self._sampling_rate)))
+        self._configure("CONFigure:ACQuisition:SRATe " + \
+                        str(int(self._sampling_rate)))
 
-        time.sleep(0.25)
         return True
 
     def set_numsamples(self, nsamp):
@@ -482,11 +895,36 @@ class Digitizer:
 
         if not is_numsamples(nsamp):
             raise Travisty("Oops! Incompatible number of samples.")
+        if not is_numrecords(self._num_records, nsamp):
+            raise Travisty("Oops! Records do not fit in memory with this " + \
+                           "number of samples.")
+
+        if nsamp == self._num_samples:
+            self._skip_configure()
+            return True
 
         self._num_samples = nsamp
-        self.device.write("CONF:ACQ:SCO " + str(int(self._num_samples)))
+        self._configure("CONF:ACQ:SCO " + str(int(self._num_samples)))
+
+        return True
+
+    def set_numrecords(self, nrec):
+        ''' Sets the number of records captured per acquisition, if
+        appropriate. With nrec > 1, a single initialize captures nrec
+        consecutive records of the set number of samples, and a single read
+        returns all of them as a (records, samples) array per channel.
+        '''
+
+        if not is_numrecords(nrec, self._num_samples):
+            raise Travisty("Oops! Incompatible number of records.")
+
+        if nrec == self._num_records:
+            self._skip_configure()
+            return True
+
+        self._num_records = nrec
+        self._configure("CONF:ACQ:RECords " + str(int(self._num_records)))
 
-        time.sleep(0.25)
         return True
 
     def set_ch_filter(self, chnum, filt_type='20 MHz'):
@@ -509,6 +947,12 @@ class Digitizer:
 
     def close(self):
 
+        # Let any background fetch finish before touching the device
+        if self._io_pool is not None:
+            self._io_pool.close()
+            self._io_pool.join()
+            self._io_pool = None
+
         # Desynchronize the digitizer
         self.device.write("SYST:SYNC:EXT NONE")
 
@@ -535,6 +979,194 @@ class Digitizer:
     def is_open(self):
         return isinstance(self.device, pyvisa.resources.usb.USBInstrument)
 
+class DigitizerGroup(object):
+    ''' Any number of digitizers acquiring together. The master digitizer
+    outputs a trigger pulse when it is initialized, and all the others (the
+    slaves) start acquiring on that pulse. Each digitizer has its own I/O
+    thread, so the traces of all of them are transferred at the same time.
+
+    The keyword arguments are passed on to every Digitizer. The digitizers can
+    be accessed by address, e.g. group['A'].
+    '''
+
+    def __init__(self, addresses, master = None, **kwargs):
+
+        if len(addresses) == 0:
+            raise Travisty("Oops! A digitizer group needs at least one " + \
+                           "digitizer.")
+
+        if master is None:
+            master = addresses[0]
+        if not master in addresses:
+            raise Travisty("Oops! The master digitizer must be in the group.")
+
+        self.addresses = list(addresses)
+        self.master = master
+        self.slaves = [a for a in self.addresses if a != master]
+
+        self.digitizers = {}
+        for address in self.addresses:
+            self.digitizers[address] = Digitizer(address, **kwargs)
+
+        self.sync()
+
+    def __getitem__(self, address):
+        return self.digitizers[address]
+
+    def __iter__(self):
+        return iter([self.digitizers[a] for a in self.addresses])
+
+    def __len__(self):
+        return len(self.addresses)
+
+    def sync(self):
+        ''' Sets up the master and slave triggers. Only needed again if the
+        digitizers were reset.
+        '''
+
+        if len(self.slaves) > 0:
+            self.digitizers[self.master].sync('master')
+            for address in self.slaves:
+                self.digitizers[address].sync('slave')
+
+    def initialize(self):
+        ''' Arms the slaves and then initializes the master, which triggers
+        them.
+        '''
+
+        for address in self.slaves:
+            self.digitizers[address].initialize()
+
+        if len(self.slaves) > 0:
+            time.sleep(0.05) # Needs a delay to sync properly
+
+        self.digitizers[self.master].initialize()
+
+    def fetch_async(self, **kwargs):
+        ''' Starts a background read (see Digitizer.fetch_async) on every
+        digitizer. Returns a dict of results keyed by address.
+        '''
+
+        return dict([(address, self.digitizers[address].fetch_async(**kwargs))
+                     for address in self.addresses])
+
+    def read(self, read_type = 'INT', ret_bin = False, poll = True):
+        ''' Reads both channels of every digitizer in parallel, after waiting
+        for the acquisition to complete if poll is True. Returns a dict of
+        traces keyed by (address, channel) and an error code, which is 1 if
+        any of the reads lost data.
+        '''
+
+        fetches = self.fetch_async(poll = poll, read_type = read_type,
+                                   ret_bin = ret_bin)
+
+        traces = {}
+        err = 0
+        for address in self.addresses:
+            V1, V2, e = fetches[address].get()
+            traces[(address, 1)] = V1
+            traces[(address, 2)] = V2
+            err = max(err, e)
+
+        return traces, err
+
+    def collect(self, fetches, dtype = 'i2'):
+        ''' Waits for the background reads returned by fetch_async, started
+        with ret_split = False and ret_bin = True, and splits the channels
+        (see deinterleave). Returns a dict of traces keyed by (address,
+        channel), like read, and an error code, which is 1 if any of the reads
+        lost data. The traces are views of the raw data.
+        '''
+
+        traces = {}
+        err = 0
+        for address in self.addresses:
+            V, e = fetches[address].get()
+            channels = deinterleave(V, num_channels = 2, dtype = dtype)
+            for i in range(len(channels)):
+                traces[(address, i + 1)] = channels[i]
+            err = max(err, e)
+
+        return traces, err
+
+    def ini_read(self, read_type = 'INT', ret_bin = False):
+        ''' Initializes, waits and returns the traces of all digitizers.'''
+
+        self.initialize()
+        return self.read(read_type = read_type, ret_bin = ret_bin)
+
+    def set_numsamples(self, nsamp):
+        ''' Sets the number of samples per acquisition on every digitizer.'''
+
+        for digi in self:
+            digi.set_numsamples(nsamp)
+
+        return True
+
+    def set_numrecords(self, nrec):
+        ''' Sets the number of records per acquisition on every digitizer.'''
+
+        for digi in self:
+            digi.set_numrecords(nrec)
+
+        return True
+
+    def close(self):
+        ''' Closes every digitizer, even if closing one of them fails.'''
+
+        errors = []
+        for address in self.addresses:
+            try:
+                self.digitizers[address].close()
+            except Exception as e:
+                errors.append(address + ": " + str(e))
+
+        if len(errors) > 0:
+            raise Travisty("Oops! Could not close digitizers " + \
+                           ", ".join(errors))
+
+def _legacy_split(data, num_samples, sample_size):
+    ''' The channel split read used before deinterleave: a list of the
+    payload's characters reshaped to (samples, 2 samples of bytes).
+    '''
+
+    n = sample_size
+    V = np.array(list(data)).reshape((num_samples, n*2))
+    V1 = V[:,:n].flatten()
+    V2 = V[:,n:2*n].flatten()
+
+    return V1.tostring(), V2.tostring()
+
+def test_deinterleave(num_samples = 1001):
+    ''' Checks that deinterleave gives the same bytes as the old split for
+    INT and FLOAT payloads, with and without trailing bytes that do not make
+    up a whole sample for both channels. Needs no digitizer. Raises an
+    AssertionError if they differ.
+    '''
+
+    for dtype in ['i2', 'f8']:
+        dtype = np.dtype(dtype)
+        n = dtype.itemsize
+        data = np.random.randint(0, 256, size = 2*n*num_samples) \
+                 .astype(np.uint8).tostring()
+
+        for trailing in range(2*n):
+            payload = data + data[:trailing]
+            V1, V2 = deinterleave(payload, num_channels = 2, dtype = dtype)
+            old1, old2 = _legacy_split(data, num_samples, n)
+
+            assert np.ascontiguousarray(V1).tostring() == old1, \
+                   "CH1 differs for " + dtype.name + ", " + str(trailing) + \
+                   " trailing bytes"
+            assert np.ascontiguousarray(V2).tostring() == old2, \
+                   "CH2 differs for " + dtype.name + ", " + str(trailing) + \
+                   " trailing bytes"
+            assert len(V1) == len(V2) == num_samples
+
+    print "deinterleave matches the old split."
+
+    return True
+
 def test(address):
     os.chdir("c:/Google Drive/logs")
 
@@ -0,0 +1,373 @@
+# A simulated Keysight/Agilent L4532A for working on the digitizer code
+# without an instrument.
+#
+# FakeResourceManager stands in for visa.ResourceManager. Pass one to
+# digitizer.Digitizer as resource_manager and the digitizer will talk to a
+# FakeL4532A instead of the USB instrument:
+#
+#     import fakedigitizer as fd
+#     digi = digitizer.Digitizer('A', resource_manager = fd.FakeResourceManager(
+#                                    offset_frequency = 625, noise = 0.002))
+#
+# Only the SCPI subset used by digitizer.py is understood. Unknown commands
+# are logged and ignored. Traces are synthetic FOSOF signals: a sinusoid at
+# the offset frequency with an amplitude, phase and DC offset per channel,
+# plus gaussian noise. All simulated digitizers in a process share a time
+# base, as if they were locked to the same clock and synchronized.
+
+from __future__ import division
+import time
+import contextlib
+import numpy as np
+import pandas as pd
+import pyvisa
+from pyvisa import constants
+import devicedata
+
+# Common time base of all simulated digitizers in this process
+_T0_ = time.time()
+
+# Digitizer settings used when C:/DEVICEDATA/digitizer.csv does not exist
+_SETTINGS_ = pd.DataFrame({'Address A': ['SIM::A::INSTR'],
+                           'Address B': ['SIM::B::INSTR'],
+                           'Channel Range': [8],
+                           'Sampling Rate': [100000],
+                           'Number of Samples': [100000],
+                           'Trigger Channel': [0],
+                           'Timeout': [2000]})
+
+# Long forms of the SCPI keywords used by digitizer.py
+_SHORT_FORMS_ = {'CONFIGURE': 'CONF',
+                 'ACQUISITION': 'ACQ',
+                 'RECORDS': 'REC',
+                 'SRATE': 'SRAT',
+                 'CHANNEL': 'CHAN',
+                 'RANGE': 'RANG',
+                 'COUPLING': 'COUP',
+                 'FILTER': 'FILT',
+                 'TRIGGER': 'TRIG',
+                 'SOURCE': 'SOUR',
+                 'FORMAT': 'FORM',
+                 'INTEGER': 'INT',
+                 'WAVEFORM': 'WAV',
+                 'VOLTAGE': 'VOLT',
+                 'INITIATE': 'INIT',
+                 'SYSTEM': 'SYST',
+                 'BORDER': 'BORD',
+                 'FETCH': 'FETC',
+                 'RECORD': 'REC'}
+
+def short_form(cmd):
+    ''' Returns the header of a SCPI command in upper case short form, e.g.
+    "CONFigure:ACQuisition:SRATe" -> "CONF:ACQ:SRAT".
+    '''
+
+    cmd = cmd.strip().upper()
+    query = cmd.endswith('?')
+    keys = cmd.rstrip('?').split(':')
+
+    return ':'.join([_SHORT_FORMS_.get(k, k) for k in keys]) + '?' * query
+
+def make_block(payload, num_digits = 9):
+    ''' Frames payload as an IEEE 488.2 definite length block followed by a
+    newline. The length is zero-padded to num_digits digits, as the L4532A
+    does. With num_digits = None, the shortest header is used.
+    '''
+
+    length = str(len(payload))
+    if num_digits is not None:
+        length = '0' * (num_digits - len(length)) + length
+
+    return '#' + str(len(length)) + length + payload + '\n'
+
+class FakeVisaLib(object):
+    ''' The part of the pyvisa VisaLibrary interface used for chunked reads.'''
+
+    def __init__(self, device):
+        self.device = device
+
+    def read(self, session, count):
+        return self.device._read_chunk(count)
+
+class FakeL4532A(object):
+    ''' A simulated L4532A behaving like a pyvisa message based resource.
+
+    offset_frequency: frequency [Hz] of the simulated signal
+    amplitudes, phases, dc: amplitude [V], phase [rad] and DC offset [V] of
+        CH1 and CH2
+    noise: rms of the gaussian noise added to every sample [V]
+    bandwidth: simulated bus bandwidth [bytes/s]. None for no delay.
+    '''
+
+    def __init__(self, address, timeout = 2000, offset_frequency = 625.,
+                 amplitudes = (0.1, 0.1), phases = (0., 0.), dc = (0., 0.),
+                 noise = 0.001, bandwidth = None, seed = None):
+
+        self.resource_name = address
+        self.timeout = timeout
+        self.chunk_size = 20 * 1024
+        self.session = id(self)
+        self.visalib = FakeVisaLib(self)
+
+        self.offset_frequency = offset_frequency
+        self.amplitudes = amplitudes
+        self.phases = phases
+        self.dc = dc
+        self.noise = noise
+        self.bandwidth = bandwidth
+        self.random = np.random.RandomState(seed)
+
+        # Every command received, in order
+        self.commands = []
+
+        self.reset()
+
+    def reset(self):
+        ''' Sets the power-on state.'''
+
+        self.sampling_rate = 2e7
+        self.num_samples = 4
+        self.num_records = 1
+        self.ranges = {1: 8., 2: 8.}
+        self.real_size = 32
+        self.byte_order = '>'
+        self.sync_state = 'NONE'
+        self.rosc = 'INT'
+
+        self._t_init = None
+        self._opc = False
+        self._esr = 0
+        self._output = ''
+        self._pos = 0
+        self._fetch = None
+
+    # pyvisa interface
+
+    def write(self, cmd):
+        self.commands.append(cmd)
+
+        # Any new command discards an unread response
+        self._output = ''
+        self._pos = 0
+        self._fetch = None
+
+        for c in cmd.split(';'):
+            self._execute(c.strip())
+
+        return len(cmd), constants.StatusCode.success
+
+    def read_raw(self, size = None):
+        size = self.chunk_size if size is None else size
+
+        data = []
+        status = constants.StatusCode.success_max_count_read
+        while status == constants.StatusCode.success_max_count_read:
+            chunk, status = self._read_chunk(size)
+            data.append(chunk)
+
+        return ''.join(data)
+
+    def read(self):
+        return self.read_raw().rstrip('\n')
+
+    def query(self, cmd):
+        self.write(cmd)
+        return self.read()
+
+    ask = query
+
+    @contextlib.contextmanager
+    def ignore_warning(self, *warnings_constants):
+        yield
+
+    def close(self):
+        self.commands.append('close')
+
+    # Simulation
+
+    def _execute(self, cmd):
+        if cmd == '':
+            return
+
+        parts = cmd.split(None, 1)
+        header = short_form(parts[0])
+        arg = parts[1].strip() if len(parts) > 1 else ''
+
+        if header == '*IDN?':
+            self._respond('Agilent Technologies,L4532A,SIMULATED,' + \
+                          self.resource_name)
+        elif header == '*RST':
+            self.reset()
+        elif header == '*CLS':
+            self._esr = 0
+        elif header == '*OPC':
+            self._opc = True
+        elif header == '*OPC?':
+            if self._t_init is not None:
+                self._wait_for_acquisition()
+            self._respond('1')
+        elif header == '*ESR?':
+            if self._opc and self._acquisition_done():
+                self._opc = False
+                self._esr |= 1
+            self._respond(str(self._esr))
+            self._esr = 0
+        elif header == 'CONF:ACQ:SRAT':
+            self.sampling_rate = float(arg)
+        elif header == 'CONF:ACQ:SCO':
+            self.num_samples = int(arg)
+        elif header == 'CONF:ACQ:REC':
+            self.num_records = int(arg)
+        elif header in ['CONF:ACQ:SRAT?', 'CONF:ACQ:SCO?', 'CONF:ACQ:REC?']:
+            self._respond(str({'CONF:ACQ:SRAT?': int(self.sampling_rate),
+                               'CONF:ACQ:SCO?': self.num_samples,
+                               'CONF:ACQ:REC?': self.num_records}[header]))
+        elif header == 'CONF:CHAN:RANG':
+            chans, rng = arg.rsplit(',', 1)
+            for ch in self._channels(chans):
+                self.ranges[ch] = float(rng)
+        elif header == 'FORM:DATA:REAL':
+            self.real_size = int(arg.split(',')[-1])
+        elif header == 'FORM:BORD':
+            self.byte_order = '<' if arg.upper().startswith('SWAP') else '>'
+        elif header == 'CONF:ROSC':
+            self.rosc = arg.upper()
+        elif header == 'CONF:ROSC?':
+            self._respond(self.rosc)
+        elif header == 'SYST:SYNC:EXT':
+            self.sync_state = arg.upper()
+        elif header == 'SYST:SYNC:EXT?':
+            self._respond(self.sync_state)
+        elif header == 'INIT':
+            self._t_init = time.time()
+            self._opc = False
+        elif header in ['FETC:WAV:ADC?', 'FETC:WAV:VOLT?']:
+            self._fetch = (header, self._channels(arg))
+
+    def _respond(self, text):
+        self._output = text + '\n'
+        self._pos = 0
+
+    def _channels(self, arg):
+        ''' Parses a channel list such as "(@1, 2)".'''
+
+        arg = arg.strip().lstrip('(').rstrip(')').lstrip('@')
+        return [int(ch) for ch in arg.split(',') if ch.strip() != '']
+
+    def _acquisition_time(self):
+        return self.num_records * self.num_samples / self.sampling_rate
+
+    def _acquisition_done(self):
+        return self._t_init is not None and \
+               time.time() >= self._t_init + self._acquisition_time()
+
+    def _wait_for_acquisition(self):
+        if self._t_init is None:
+            raise pyvisa.errors.VisaIOError(constants.VI_ERROR_TMO)
+
+        t_left = self._t_init + self._acquisition_time() - time.time()
+        if t_left > self.timeout / 1000.:
+            raise pyvisa.errors.VisaIOError(constants.VI_ERROR_TMO)
+        if t_left > 0:
+            time.sleep(t_left)
+
+    def _read_chunk(self, count):
+        # Like FETCH on the instrument, the first read of a waveform blocks
+        # until the acquisition is complete.
+        if self._fetch is not None:
+            header, chans = self._fetch
+            self._fetch = None
+            self._wait_for_acquisition()
+            self._output = make_block(self.waveform(chans,
+                                                    header.endswith('ADC?')))
+            self._pos = 0
+
+        if self._pos >= len(self._output):
+            raise pyvisa.errors.VisaIOError(constants.VI_ERROR_TMO)
+
+        chunk = self._output[self._pos:self._pos+count]
+        self._pos += len(chunk)
+
+        if self.bandwidth is not None:
+            time.sleep(len(chunk) / self.bandwidth)
+
+        if self._pos < len(self._output):
+            return chunk, constants.StatusCode.success_max_count_read
+
+        self._output = ''
+        self._pos = 0
+        return chunk, constants.StatusCode.success
+
+    def waveform(self, chans, adc = True):
+        ''' Returns the payload of a FETCH of the last acquisition for the
+        channels given: records one after the other, samples interleaved by
+        channel, in the set data format and byte order.
+        '''
+
+        n = self.num_records * self.num_samples
+        t = self._t_init - _T0_ + np.arange(n) / self.sampling_rate
+        omega = 2.0 * np.pi * self.offset_frequency
+
+        V = np.empty((n, len(chans)))
+        for i, ch in enumerate(chans):
+            V[:,i] = self.dc[ch-1] + \
+                     self.amplitudes[ch-1] * np.cos(omega * t - \
+                                                    self.phases[ch-1]) + \
+                     self.noise * self.random.standard_normal(n)
+
+            # Quantize as the 16 bit ADC does
+            V[:,i] = np.clip(np.round(V[:,i] / self.ranges[ch] * 32767),
+                             -32768, 32767)
+            if not adc:
+                V[:,i] *= self.ranges[ch] / 32767
+
+        if adc:
+            dt = self.byte_order + 'i2'
+        else:
+            dt = self.byte_order + 'f' + str(self.real_size // 8)
+
+        return V.astype(dt).tostring()
+
+class FakeResourceManager(object):
+    ''' Stands in for visa.ResourceManager. Every resource opened is a
+    FakeL4532A created with the keyword arguments given here.
+    '''
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.resources = {}
+
+    def open_resource(self, address, timeout = 2000, **kwargs):
+        device = FakeL4532A(address, timeout = timeout, **self.kwargs)
+        self.resources[address] = device
+        return device
+
+    def list_resources(self):
+        return tuple(self.resources.keys())
+
+def test(num_samples = 100000, bandwidth = 20e6):
+    ''' Reads two channels from a simulated digitizer and prints the time it
+    took and the fitted phase difference.
+    '''
+
+    import digitizer
+    import fosof_qol as qol
+
+    if not devicedata.exists('digitizer'):
+        devicedata.set_table('digitizer', _SETTINGS_)
+
+    rm = FakeResourceManager(phases = (0., 1.), bandwidth = bandwidth)
+    digi = digitizer.Digitizer('A', sampling_rate = int(1e5),
+                               num_samples = num_samples,
+                               trigger_channel = 0, clocked = False,
+                               resource_manager = rm)
+
+    t_s = time.time()
+    V1, V2, err = digi.ini_read(read_type = 'INT', ret_bin = False)
+    print("Time to acquire and read [s]: " + str(time.time() - t_s))
+
+    phi1 = qol.fit(V1, 1e-5, 625.)[1]
+    phi2 = qol.fit(V2, 1e-5, 625.)[1]
+    print("Phase difference [rad]: " + str((phi2 - phi1) % (2 * np.pi)))
+
+    digi.close()
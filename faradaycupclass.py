@@ -1,11 +1,7 @@
 import u3
 import LabJackPython
 import fosof_qol as qol
-import pandas as pd
-
-_DEFAULT_FILE_LOCATION_ = "C:/DEVICEDATA/"
-info_file = pd.read_csv(_DEFAULT_FILE_LOCATION_ + "faradaycup.csv")
-info_file = info_file.set_index("F-Cup ID")
+import devicedata
 
 class FaradayCup(object):
 
@@ -35,6 +31,9 @@ class FaradayCup(object):
     def get_current(self, fcid):
         """ Returns the current from the Faraday cup in uA."""
 
+        # Pins of the cups, from C:/DEVICEDATA/faradaycup.csv
+        info_file = devicedata.get_table("faradaycup", index_col = "F-Cup ID")
+
         if fcid in info_file.index:
             return self.device.getAIN(int(info_file.ix[fcid]["AIN Pin"]))*10
         elif fcid == "all":
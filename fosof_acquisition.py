@@ -7,11 +7,13 @@ import digitizer
 import quench
 import generator
 from datetime import datetime as dt
-from acquisition import Acquisition
+from acquisition import Acquisition, RecordBuffer
 import traceback as tb
 import faradaycupclass
 import visa
 import B_field_control as bfc
+import tracearchive
+import fosofanalysis
 import sys
 
 # Run Dictionary Keys
@@ -40,9 +42,10 @@ import sys
 # Power Combiner on Detector Digitizer = R or I
 # Quenches = filename
 # Binary Traces = bool
+# Trace Codec = raw or zlib (optional, raw if missing)
 
-independent_rd_location = qol.path_file['Run Queue'] + \
-                          'waveguide_calibration_DEFAULT.rd'
+# Run dictionary used when the acquisition is run on its own (see main)
+independent_rd_name = 'waveguide_calibration_DEFAULT.rd'
 
 class FOSOFAcquisition(Acquisition):
 
@@ -114,27 +117,21 @@ class FOSOFAcquisition(Acquisition):
         self.other_addr.remove(self.digi_addr)
         self.other_addr = self.other_addr[0]
 
-        self.digi1 = digitizer.Digitizer(self.digi_addr, \
-                                         ch1_range = self.ch_range, \
-                                         ch2_range = self.ch_range, \
-                                         sampling_rate = self.sampling_rate, \
-                                         num_samples = self.num_samples,
-                                         timeOut = 30)
-        self.digi2 = digitizer.Digitizer(self.other_addr, \
-                                         ch1_range = self.ch_range, \
-                                         ch2_range = self.ch_range, \
-                                         sampling_rate = self.sampling_rate, \
-                                         num_samples = self.num_samples,
-                                         timeOut = 30)
+        # The digitizer with the detector is the master. The group syncs the
+        # other one to a signal from it when it is initialized.
+        self.digis = digitizer.DigitizerGroup([self.digi_addr, self.other_addr],
+                                              master = self.digi_addr,
+                                              ch1_range = self.ch_range,
+                                              ch2_range = self.ch_range,
+                                              sampling_rate = self.sampling_rate,
+                                              num_samples = self.num_samples,
+                                              timeOut = 30,
+                                              num_buffers = 2)
         self.digi_det = int(self.run_dictionary.ix['Digitizer Channel ' + \
                                                    'for Detector'].Value) - 1
         self.digi_c1 = 1 - self.digi_det # Combiner channels
         self.digi_c2 = self.digi_det
 
-        # Sync the digitizers (to a signal from digi1 when digi1 is initialized)
-        self.digi1.sync('master')
-        self.digi2.sync('slave')
-
         self.progress = 'Opening generator'
 
         self.wg_efield = int(self.run_dictionary \
@@ -283,21 +280,35 @@ class FOSOFAcquisition(Acquisition):
                 "Pre-Quench 910 State",
                 "Waveguide A Power Reading  [V]",
                 "Waveguide B Power Reading [V]",
-                "Time",
-                "Detector Trace Filename",
-                "RF Power Combiner " + p_comb + " Digi 1 Trace Filename",
-                "RF Power Combiner " + p_comb_2 + " Trace Filename",
-                "RF Power Combiner " + p_comb + " Digi 2 Trace Filename",
-                "fc1a [uA]",
-                "fc1b [uA]",
-                "fc1c [uA]",
-                "fc1d [uA]",
-                "fc2i [uA]",
-                "fc2ii [uA]",
-                "fc2iii [uA]",
-                "fc2iv [uA]",
-                "fc3 [uA]",
-                "fccentre [uA]"]
+                "Time"]
+
+        # Digitizer address and channel of each saved trace, with the data.txt
+        # column for its filename. The traces are numbered _01, _02, ... in
+        # this order. A digitizer added to the group only needs entries here.
+        self.trace_channels = [("Detector Trace Filename",
+                                self.digi_addr, self.digi_det + 1),
+                               ("RF Power Combiner " + p_comb + \
+                                " Digi 1 Trace Filename",
+                                self.digi_addr, self.digi_c1 + 1),
+                               ("RF Power Combiner " + p_comb_2 + \
+                                " Trace Filename",
+                                self.other_addr, self.digi_c2 + 1),
+                               ("RF Power Combiner " + p_comb + \
+                                " Digi 2 Trace Filename",
+                                self.other_addr, self.digi_c1 + 1)]
+
+        cols += [column for column, address, channel in self.trace_channels]
+
+        cols += ["fc1a [uA]",
+                 "fc1b [uA]",
+                 "fc1c [uA]",
+                 "fc1d [uA]",
+                 "fc2i [uA]",
+                 "fc2ii [uA]",
+                 "fc2iii [uA]",
+                 "fc2iv [uA]",
+                 "fc3 [uA]",
+                 "fccentre [uA]"]
 
         for q in self.open_quenches:
             cols.append(qol.formatted_quench_name(q) + \
@@ -305,11 +316,22 @@ class FOSOFAcquisition(Acquisition):
             cols.append(qol.formatted_quench_name(q) + \
                         ' Attenuator Voltage Reading [V]')
 
+        # Columns not listed here are floats
+        dtypes = {'Repeat' : int,
+                  'Average' : int,
+                  'Configuration' : object,
+                  'Offset Frequency [Hz]' : int,
+                  'Pre-Quench 910 State' : object}
+        for col in cols:
+            if col.endswith('Filename'):
+                dtypes[col] = object
+
         # Write column headers
-        self.data = pd.DataFrame(columns = cols)
-        data_file = open(self.folder + 'data.txt', 'a')
-        self.data.to_csv(data_file, index = False)
-        data_file.close()
+        self.data = RecordBuffer(cols, dtypes = dtypes)
+        self.data.write_header(self.folder + 'data.txt')
+        self.data.open_sidecar(self.folder + qol.DATA_COLUMNS_FOLDER,
+                               run_dictionary = self.run_dictionary['Value'] \
+                                                    .to_dict())
         print('\t'.join(self.data.columns))
 
         self.rep = 0
@@ -336,6 +358,28 @@ class FOSOFAcquisition(Acquisition):
                             self.num_910_states
         self.num_complete = 0
 
+        # All traces of the run are appended to one archive file (see
+        # tracearchive.py). The archive is written on a separate thread so
+        # the disk does not add to the dead time.
+        if 'Trace Codec' in self.run_dictionary.index:
+            self.codec = self.run_dictionary.ix['Trace Codec'].Value
+        else:
+            self.codec = 'raw'
+
+        if self.bin is not None:
+            self.archive = tracearchive.AsyncTraceWriter(self.bin + \
+                                                         'traces.trc',
+                                                         codec = self.codec)
+        else:
+            self.archive = None
+
+        # The amplitudes and phases at the offset frequency are found during
+        # the run by a separate process (see fosofanalysis.PhaseWorker)
+        self.phase_worker = fosofanalysis.PhaseWorker(self.folder,
+                                                      1./self.sampling_rate,
+                                                      float(self.ch_range)/ \
+                                                      digitizer.ADC_FULL_SCALE)
+
         self.progress = 'Initialization complete'
         self.start_time = time.time()
         print('Beginning acquisition...')
@@ -384,14 +428,12 @@ class FOSOFAcquisition(Acquisition):
 
             if pre910_state == 'on':
                 self.qm.cavity_on('pre-quench_910')
-                self.digi1.set_numsamples(self.pre910_num_samples)
-                self.digi2.set_numsamples(self.pre910_num_samples)
+                self.digis.set_numsamples(self.pre910_num_samples)
                 self.trace_length_s = float(self.pre910_num_samples) / \
                                       float(self.sampling_rate)
             else:
                 self.qm.cavity_off('pre-quench_910')
-                self.digi1.set_numsamples(self.num_samples)
-                self.digi2.set_numsamples(self.num_samples)
+                self.digis.set_numsamples(self.num_samples)
                 self.trace_length_s = float(self.num_samples) / \
                                       float(self.sampling_rate)
             print("910 state switched.")
@@ -428,10 +470,14 @@ class FOSOFAcquisition(Acquisition):
 
                     t_s = time.time()
                     # Initialize trace acquisition
-                    self.digi2.initialize()
-                    time.sleep(0.05) # Needs a delay to sync properly
-                    self.digi1.initialize()
-                    time_init = time.time()
+                    self.digis.initialize()
+
+                    # Fetch the traces in the background as soon as they have
+                    # been acquired. Everything below runs while the
+                    # digitizers acquire and transfer.
+                    print("TRACE LENGTH: " + str(self.trace_length_s))
+                    fetches = self.digis.fetch_async(poll = True,
+                                                     ret_split = False)
 
                     # Read measured values other than digitizer traces while
                     # waiting for the acquisition
@@ -443,110 +489,67 @@ class FOSOFAcquisition(Acquisition):
 
                     fc_currents = np.array(self.fcup.get_current("all"))
 
-                    # Split data from digitizer and save each channel to a
-                    # different binary file
+                    # Append each channel of the last traces to the trace
+                    # archive and hand them to the phase worker
                     if self.num_complete > 0:
-                        self.V1 = np.array(list(self.V1)) \
-                                    .reshape((self.Vnumsamps,4))
-
-                        n = self.digi_det + 1
-                        self.V_det = self.V1[:,(n-1)*2:n*2].flatten()
-
-                        n = self.digi_c1 + 1
-                        self.V1_c1 = self.V1[:,(n-1)*2:n*2].flatten()
-
-                        self.V2 = np.array(list(self.V2)) \
-                                    .reshape((self.Vnumsamps,4))
-
-                        n = self.digi_c1 + 1
-                        self.V2_c1 = self.V2[:,(n-1)*2:n*2].flatten()
-
-                        n = self.digi_c2 + 1
-                        self.V2_c2 = self.V2[:,(n-1)*2:n*2].flatten()
-
                         self.save_traces(self.filenames)
+                        self.analyze_traces(self.filenames)
 
                     # Generate filenames from the current acquisition
-                    d1c1_filename = self.make_filename(1)
-                    d1c2_filename = self.make_filename(2)
-                    d2c1_filename = self.make_filename(3)
-                    d2c2_filename = self.make_filename(4)
+                    self.filenames = [self.make_filename(i + 1) for i \
+                                      in range(len(self.trace_channels))]
 
-                    self.filenames = np.array([d1c1_filename, d1c2_filename,
-                                               d2c1_filename, d2c2_filename])
-
-                    # Prepare the array to append to the main DataFrame
-                    data_to_append = np.array([int(self.rep) + 1,
-                                               int(self.avg) + \
+                    # Settings saved with the traces in the archive
+                    self.trace_info = {'rep' : int(self.rep) + 1,
+                                       'avg' : int(self.avg) + \
                                                self.switch_iterator + 1,
-                                               self.ab,
-                                               self.gen_frequency,
-                                               b_field[1],
-                                               b_field[3],
-                                               offset_frequency,
-                                               pre910_state,
-                                               wg_A_power,
-                                               wg_B_power,
-                                               time.time(),
-                                               d1c1_filename,
-                                               d1c2_filename,
-                                               d2c1_filename,
-                                               d2c2_filename])
-
-                    data_to_append = np.append(data_to_append, fc_currents)
+                                       'freq' : self.gen_frequency,
+                                       'b_x' : float(b_field[1]),
+                                       'b_y' : float(b_field[3]),
+                                       'offset_freq' : offset_frequency,
+                                       'config' : self.ab,
+                                       'pre910' : ''}
+                    if self.num_910_states > 1:
+                        self.trace_info['pre910'] = pre910_state
+
+                    # Prepare the row to append to the data table
+                    data_to_append = [int(self.rep) + 1,
+                                      int(self.avg) + self.switch_iterator + 1,
+                                      self.ab,
+                                      self.gen_frequency,
+                                      float(b_field[1]),
+                                      float(b_field[3]),
+                                      offset_frequency,
+                                      pre910_state,
+                                      wg_A_power,
+                                      wg_B_power,
+                                      time.time()]
+
+                    data_to_append += self.filenames
+                    data_to_append += list(fc_currents)
 
                     for quench_index in self.open_quenches:
-                        this_quench = [powers[quench_index],
-                                       atten_vs_read[quench_index]]
-                        data_to_append = np.append(data_to_append, this_quench)
+                        data_to_append += [powers[quench_index],
+                                           atten_vs_read[quench_index]]
 
                     # Append the current data
                     print('\t'.join(list(map(str,data_to_append))))
-                    self.data = self.data \
-                                    .append(pd.Series(data_to_append,
-                                                      name = len(self.data),
-                                                      index = self.data.columns
-                                                      )
-                                            )
+                    self.data.append(data_to_append)
                     t_f = time.time()
                     print("Time to initialize and prepare: " + str(t_f - t_s))
 
-                    # If necessary, wait for the trace to finish acquiring
-                    # NOTE 01/03/2017: Perhaps in the future, we can use a
-                    # separate thread to acquire the digitizer traces and just
-                    # use a 'join' function here on the thread.
-                    t_dif = time.time() - time_init
-                    print("TRACE LENGTH: " + str(self.trace_length_s))
-                    if t_dif < self.trace_length_s:
-                        print("sleeping " + str(self.trace_length_s - t_dif + 0.1))
-                        time.sleep(self.trace_length_s - t_dif + 0.1)
-                    else: print("Not sleeping. t_dif is "+str(t_dif))
-
-                    t_s = time.time()
-                    self.V1 = self.digi1.read(ret_split = False)[0]
-                    t_f = time.time()
-                    print("Time to read from digitizer 1: " + str(t_f - t_s))
-
+                    # Wait for the background fetches to finish
                     t_s = time.time()
-                    self.V2 = self.digi2.read(ret_split = False)[0]
+                    self.traces, err = self.digis.collect(fetches)
                     t_f = time.time()
-                    print("Time to read from digitizer 2: " + str(t_f - t_s))
-
-                    self.Vnumsamps = self.digi1.get_numsamples()
+                    print("Time waited for digitizers: " + str(t_f - t_s))
 
                     self.switch_iterator += 1
                     self.num_complete += 1
                 self.ab_iterator += 1
             self.avg += self.traces_btwn_switch
 
-        data_file = open(self.folder + 'data.txt', 'a')
-        data_out = self.data.iloc[-2*self.max_avg:] \
-                            .set_index(['Repeat',
-                                        'Average',
-                                        'Configuration',
-                                        'Waveguide Carrier Frequency [MHz]'])
-        data_out.to_csv(data_file, header = False)
-        data_file.close()
+        self.data.flush_to(self.folder + 'data.txt')
 
         self.avg = 0
         self.pre910_state_iterator += 1
@@ -587,37 +590,48 @@ class FOSOFAcquisition(Acquisition):
         # Check if all repeats have been completed
         # If so, end the acquisition and notify the manager
         if self.rep == self.max_rep:
-            self.V1 = np.array(list(self.V1)) \
-                        .reshape((self.Vnumsamps,4))
-
-            n = self.digi_det + 1
-            self.V_det = self.V1[:,(n-1)*2:n*2].flatten()
-
-            n = self.digi_c1 + 1
-            self.V1_c1 = self.V1[:,(n-1)*2:n*2].flatten()
-
-            self.V2 = np.array(list(self.V2)) \
-                        .reshape((self.Vnumsamps,4))
-
-            n = self.digi_c1 + 1
-            self.V2_c1 = self.V2[:,(n-1)*2:n*2].flatten()
-
-            n = self.digi_c2 + 1
-            self.V2_c2 = self.V2[:,(n-1)*2:n*2].flatten()
             self.save_traces(self.filenames)
+            self.analyze_traces(self.filenames)
             self.progress = 'Finished'
             self.end_time = time.time()
             print("Total time elapsed [s]: " + str(self.end_time - self.start_time))
+            print("Time saved by polling the digitizers [s]: " + \
+                  str(sum([digi.get_margin_saved()[1] \
+                           for digi in self.digis])))
+            print("Time saved by skipping digitizer reconfiguration [s]: " + \
+                  str(sum([digi.get_config_savings()[1] \
+                           for digi in self.digis])))
+            if self.archive is not None:
+                print("Trace writer: " + str(self.archive.get_stats()))
+            print("Phase worker: " + str(self.phase_worker.get_stats()))
             print("")
             self.acquisition_complete = True
 
         return
 
     def save_traces(self, filenames):
-        vlist = [self.V_det, self.V1_c1, self.V2_c2, self.V2_c1]
-        for i in range(4):
-            np.save(self.bin + filenames[i] + ".digi",
-                    np.frombuffer(vlist[i], dtype = np.dtype('i2')))
+        ''' Appends the last traces to the run's trace archive, under the names
+        in filenames. Channel n of the archive is the trace whose name ends in
+        _0n.
+        '''
+
+        if self.archive is None:
+            return
+
+        for i, (column, address, channel) in enumerate(self.trace_channels):
+            self.archive.append(self.traces[(address, channel)],
+                                name = filenames[i], channel = i + 1,
+                                **self.trace_info)
+
+    def analyze_traces(self, filenames):
+        ''' Hands the last traces to the phase worker. They are skipped if the
+        worker is behind, so this never holds up the acquisition.
+        '''
+
+        vlist = [self.traces[(address, channel)] for column, address, channel \
+                 in self.trace_channels]
+        self.phase_worker.submit(fosofanalysis.acquisition_name(filenames[0]),
+                                 vlist, self.trace_info['offset_freq'])
 
     def make_filename(self, num):
         r_name = "r" + "0" * (3 - len(str(self.rep+1))) + str(self.rep+1)
@@ -656,6 +670,9 @@ class FOSOFAcquisition(Acquisition):
                         str(int(100. * self.num_complete/self.total_traces)) + \
                         '\%'
         self.close_instruments()
+
+        if self.archive is not None:
+            self.archive.flush()
         super(FOSOFAcquisition, self).pause()
 
         return
@@ -675,25 +692,18 @@ class FOSOFAcquisition(Acquisition):
         self.qm.cavities_off(["pre-quench_910","post-quench_910"])
 
         # Setting up digitizers
-        self.digi1 = digitizer.Digitizer(self.digi_addr, \
-                                         ch1_range = self.ch_range, \
-                                         ch2_range = self.ch_range, \
-                                         sampling_rate = self.sampling_rate, \
-                                         num_samples = self.num_samples)
-        self.digi2 = digitizer.Digitizer(self.other_addr, \
-                                         ch1_range = self.ch_range, \
-                                         ch2_range = self.ch_range, \
-                                         sampling_rate = self.sampling_rate, \
-                                         num_samples = self.num_samples)
-
-        self.digi1.sync('master')
-        self.digi2.sync('slave')
+        self.digis = digitizer.DigitizerGroup([self.digi_addr, self.other_addr],
+                                              master = self.digi_addr,
+                                              ch1_range = self.ch_range,
+                                              ch2_range = self.ch_range,
+                                              sampling_rate = self.sampling_rate,
+                                              num_samples = self.num_samples,
+                                              num_buffers = 2)
 
         # Configure digitizers & quenches for last pre-quench 910 state
         if self.pre910_state == 'on':
             self.qm.cavity_on("pre-quench_910")
-            self.digi1.set_numsamples(self.pre910_num_samples)
-            self.digi2.set_numsamples(self.pre910_num_samples)
+            self.digis.set_numsamples(self.pre910_num_samples)
 
         # Setting up the generator
         self.gen = generator.Generator(calib = False,
@@ -722,6 +732,19 @@ class FOSOFAcquisition(Acquisition):
 
         self.progress = 'Shutting down'
         self.close_instruments()
+
+        try:
+            self.progress = 'Closing trace archive'
+            if self.archive is not None:
+                self.archive.close()
+        except Exception as e:
+            sys.stderr.write(tb.format_exc())
+
+        try:
+            self.progress = 'Stopping phase worker'
+            self.phase_worker.close()
+        except Exception as e:
+            sys.stderr.write(tb.format_exc())
         super(FOSOFAcquisition, self).shut_down()
 
         return
@@ -737,8 +760,7 @@ class FOSOFAcquisition(Acquisition):
 
         try:
             self.progress = 'Closing digitizers'
-            self.digi1.close()
-            self.digi2.close()
+            self.digis.close()
         except Exception as e:
             sys.stderr.write(tb.format_exc())
 
@@ -774,7 +796,7 @@ def main():
     queue_out = mp.queues.Queue()
     queue_err = mp.queues.Queue()
 
-    queue_in.put(independent_rd_location)
+    queue_in.put(qol.path_file['Run Queue'] + independent_rd_name)
 
     acq = PhaseMonitor(queue_in, queue_out, queue_err)
 
@@ -15,6 +15,9 @@ import numpy as np
 from numpy import sin, cos, tan, pi
 import thread
 import socket
+import collections
+import json
+import devicedata
 
 
 try:
@@ -22,12 +25,13 @@ try:
 except ImportError:
     from queue import Queue, Empty
 
-_DEFAULT_FILE_LOCATION_ = 'C:/DEVICEDATA/'
-path_file = pd.read_csv(_DEFAULT_FILE_LOCATION_ + "paths.csv")
-path_file = pd.Series(path_file.ix[0]) # Turning this into a dict (basically)
+# Folder locations, read from C:/DEVICEDATA/paths.csv when first needed. Works
+# like a dict.
+path_file = devicedata.Settings('paths')
 
-_GD_DATA_PATH_ = path_file["Data"]
-_BINARY_PATH_ = path_file["Binary Traces"]
+# Folder in a run's data folder with the binary copy of data.txt (see
+# acquisition.RecordBuffer.open_sidecar and load_data_columns)
+DATA_COLUMNS_FOLDER = 'data columns'
 
 
 class Travisty(Exception):
@@ -74,7 +78,7 @@ def make_gd_folder(main_name, addon, make_bin = False):
     start_time_string = time.strftime("%H%M%S")
     filename_prefix = date.today().strftime("%y%m%d")+ "-" + start_time_string
     directory_name = filename_prefix + " - " + main_name + " - " + addon
-    absolute = _GD_DATA_PATH_ + directory_name + '/'
+    absolute = path_file["Data"] + directory_name + '/'
 
     os.mkdir(absolute)
 
@@ -89,7 +93,8 @@ def make_binary_folder(main_name, prefix, addon):
     and returns the absolute path to the new folder.
     '''
 
-    absolute = _BINARY_PATH_ + prefix + " - " + main_name + " - " + addon +  "/"
+    absolute = path_file["Binary Traces"] + prefix + " - " + main_name + \
+               " - " + addon +  "/"
     os.mkdir(absolute)
     os.mkdir(absolute + "run parameters/")
 
@@ -106,11 +111,12 @@ def fit(y,dt,f):
     # f - frequency of interest in HERTZ
 
     data_length = len(y)
-    omega = 2.0*pi*f
-    t = np.linspace(0,(data_length-1)*dt,data_length)
 
-    a = 2.0*np.average(y*cos(omega*t))
-    b = 2.0*np.average(y*sin(omega*t))
+    # cos(omega t) and sin(omega t), where t = 0, dt, ..., (data_length-1)*dt
+    basis = basis_cache.get(data_length, dt, [f])
+
+    a = 2.0*np.dot(y, basis[:,0])/data_length
+    b = 2.0*np.dot(y, basis[:,1])/data_length
     c = np.average(y)
 
     A = np.sqrt(a**2 + b**2)
@@ -121,6 +127,429 @@ def fit(y,dt,f):
     # Returns: amplitude of the waveform A, phase phi, and DC offset c
     return np.float(A), np.float(phi), np.float(c)
 
+def fourier_basis(data_length, dt, freqs):
+    # Basis matrix for fit_batch, with the time axis of fit. Columns 0 to F-1
+    # are cos(omega_j t) and columns F to 2F-1 are sin(omega_j t) for the F
+    # frequencies in freqs [Hz].
+
+    omega = 2.0*pi*np.atleast_1d(np.asarray(freqs, dtype = float))
+    t = np.linspace(0,(data_length-1)*dt,data_length)
+    wt = np.outer(t, omega)
+
+    return np.concatenate((cos(wt), sin(wt)), axis = 1)
+
+class BasisCache(object):
+    ''' Keeps the Fourier basis matrices (see fourier_basis) used by the fits,
+    since a run only uses a few trace lengths and frequencies. Matrices are
+    keyed by (number of samples, dt, frequencies, dtype). When the matrices
+    take up more than max_bytes, the least recently used ones are dropped. The
+    cached matrices are read-only.
+    '''
+
+    def __init__(self, max_bytes = 128*2**20):
+        self.max_bytes = max_bytes
+        self._tables = collections.OrderedDict()
+        self._num_bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, data_length, dt, freqs, dtype = np.float64):
+        ''' Returns fourier_basis(data_length, dt, freqs) as an array of
+        dtype.
+        '''
+
+        key = ('fourier', int(data_length), float(dt),
+               tuple(float(f) for f in np.atleast_1d(freqs)),
+               np.dtype(dtype).str)
+
+        return self.lookup(key, lambda: fourier_basis(data_length, dt, freqs) \
+                                            .astype(dtype))
+
+    def lookup(self, key, make):
+        ''' Returns the matrix cached under key. If there is none, it is made
+        by calling make and cached.
+        '''
+
+        with self._lock:
+            if key in self._tables:
+                self.hits += 1
+                basis = self._tables.pop(key)
+                self._tables[key] = basis
+                return basis
+
+        basis = make()
+        basis.flags.writeable = False
+
+        with self._lock:
+            self.misses += 1
+
+            # Matrices too big for the cache are not kept
+            if basis.nbytes <= self.max_bytes and not key in self._tables:
+                self._tables[key] = basis
+                self._num_bytes += basis.nbytes
+
+                while self._num_bytes > self.max_bytes:
+                    old_key, old = self._tables.popitem(last = False)
+                    self._num_bytes -= old.nbytes
+                    self.evictions += 1
+
+        return basis
+
+    def stats(self):
+        ''' Returns the number of hits, misses and evictions, and the number of
+        matrices and bytes in the cache.
+        '''
+
+        with self._lock:
+            return {'hits' : self.hits,
+                    'misses' : self.misses,
+                    'evictions' : self.evictions,
+                    'tables' : len(self._tables),
+                    'bytes' : self._num_bytes}
+
+    def clear(self):
+        with self._lock:
+            self._tables.clear()
+            self._num_bytes = 0
+
+# Shared by all fits in a process
+basis_cache = BasisCache()
+
+def fit_batch(Y,dt,freqs):
+    # Same as fit for many traces and frequencies at once. All amplitudes and
+    # phases come from one matrix product of the traces with fourier_basis.
+    # Input parameters are:
+    # Y - digitizer traces, one per row (a single 1D trace also works)
+    # dt - time elapsed between each data point in SECONDS
+    # freqs - list of frequencies of interest in HERTZ
+
+    Y = np.asarray(Y, dtype = float)
+    single = (Y.ndim == 1)
+    Y = np.atleast_2d(Y)
+
+    data_length = Y.shape[1]
+    num_freqs = len(np.atleast_1d(freqs))
+
+    P = 2.0*np.dot(Y, basis_cache.get(data_length, dt, freqs))/data_length
+    a = P[:,:num_freqs]
+    b = P[:,num_freqs:]
+    c = np.mean(Y, axis = 1)
+
+    A = np.sqrt(a**2 + b**2)
+    phi = (np.arctan2(b,a) + 2.0*pi) % (2.0*pi)
+
+    # Returns: amplitudes A and phases phi with one row per trace and one
+    # column per frequency, and DC offsets c with one value per trace. For a
+    # 1D trace, A and phi have one value per frequency and c is a float.
+    if single:
+        return A[0], phi[0], np.float(c[0])
+
+    return A, phi, c
+
+def lsq_design_matrix(data_length, dt, freqs, drift = False):
+    # Design matrix of fit_lsq, with the time axis of fit. For F frequencies
+    # in freqs, columns 0 to F-1 are cos(omega_j t), columns F to 2F-1 are
+    # sin(omega_j t), column 2F is 1 and, if drift is True, column 2F+1 is t.
+
+    t = np.linspace(0,(data_length-1)*dt,data_length)
+
+    columns = [fourier_basis(data_length, dt, freqs), np.ones((data_length,1))]
+    if drift:
+        columns.append(t[:,np.newaxis])
+
+    return np.concatenate(columns, axis = 1)
+
+def lsq_coefficients(Y, dt, freqs, drift = False):
+    # Least-squares coefficients of the lsq_design_matrix columns for traces
+    # Y (time on the last axis). The transposed pseudo-inverse of the design
+    # matrix is cached.
+
+    data_length = Y.shape[-1]
+
+    key = ('lsq', int(data_length), float(dt),
+           tuple(float(f) for f in np.atleast_1d(freqs)), bool(drift))
+    make = lambda: np.ascontiguousarray(np.linalg.pinv( \
+                       lsq_design_matrix(data_length, dt, freqs, drift)).T)
+
+    return np.dot(Y, basis_cache.lookup(key, make))
+
+def fit_lsq(Y,dt,f,drift=False):
+    # Fit data to: y(t) = a cos(omega t) + b sin(omega t) + c (+ d t)
+    #                   = A cos(omega t - phi) + c (+ d t)
+    # by least squares. Unlike fit, this is exact for any trace length, not
+    # just a whole number of periods, and can include a linear drift. The
+    # pseudo-inverse of the design matrix is computed once for each (number
+    # of samples, dt, f, drift) and cached, so a fit is one matrix product.
+    # Input parameters are:
+    # Y - digitizer traces, one per row, or a single 1D trace
+    # dt - time elapsed between each data point in SECONDS
+    # f - frequency of interest in HERTZ
+    # drift - if True, also fit a linear drift d [units of Y per second]
+
+    Y = np.asarray(Y, dtype = float)
+
+    coeffs = lsq_coefficients(Y, dt, [f], drift = drift)
+    a = coeffs[...,0]
+    b = coeffs[...,1]
+    c = coeffs[...,2]
+
+    A = np.sqrt(a**2 + b**2)
+    phi = (np.arctan2(b,a) + 2.0*pi) % (2.0*pi)
+
+    # Returns: amplitude A, phase phi, DC offset c (at t = 0) and, if drift
+    # is True, the drift d. These are floats for a 1D trace and arrays with
+    # one value per trace otherwise.
+    results = [A, phi, c]
+    if drift:
+        results.append(coeffs[...,3])
+
+    if Y.ndim == 1:
+        results = [np.float(r) for r in results]
+
+    return tuple(results)
+
+def check_lsq(num_periods = 64, dt = 1e-6, f = 625., num_traces = 10,
+              tolerance = 1e-8):
+    ''' Checks fit_lsq, fit_batch and the basis cache on simulated traces:
+        - on a whole number of periods, fit_lsq and fit_batch agree with fit
+        - on a trace that is not a whole number of periods, fit_lsq with
+          drift = True recovers the known amplitude, phase, DC offset and
+          drift
+        - fitting the same trace length again is a basis_cache hit
+    Prints and returns the largest differences, and raises a Travisty if any
+    is above tolerance (relative to the amplitude for amplitudes and DC
+    offsets, in rad for phases).
+    '''
+
+    A0 = 1.5
+    c0 = 0.2
+    d0 = 3.0
+
+    # Whole number of periods, with noise
+    num_samples = int(round(num_periods/(f*dt)))
+    t = np.arange(num_samples)*dt
+    phases = 2.0*pi*np.random.rand(num_traces, 1)
+    Y = A0*cos(2.0*pi*f*t - phases) + c0 + \
+        0.1*np.random.randn(num_traces, num_samples)
+
+    ref = np.array([fit(y, dt, f) for y in Y])
+    A, phi, c = fit_lsq(Y, dt, f)
+    A_b, phi_b, c_b = fit_batch(Y, dt, [f])
+
+    wrap = lambda x: np.abs((x + pi) % (2.0*pi) - pi)
+    results = {'lsq vs fit amplitude' : np.max(np.abs(A - ref[:,0]))/A0,
+               'lsq vs fit phase' : np.max(wrap(phi - ref[:,1])),
+               'lsq vs fit DC' : np.max(np.abs(c - ref[:,2]))/A0,
+               'batch vs fit amplitude' : \
+                   np.max(np.abs(A_b[:,0] - ref[:,0]))/A0,
+               'batch vs fit phase' : np.max(wrap(phi_b[:,0] - ref[:,1]))}
+
+    # A third of a period more, with a drift and no noise
+    num_samples += int(round(1.0/(3*f*dt)))
+    t = np.arange(num_samples)*dt
+    y = A0*cos(2.0*pi*f*t - phases[0,0]) + c0 + d0*t
+
+    hits = basis_cache.stats()['hits']
+    A, phi, c, d = fit_lsq(y, dt, f, drift = True)
+    fit_lsq(y, dt, f, drift = True)
+
+    results['drift fit amplitude'] = abs(A - A0)/A0
+    results['drift fit phase'] = wrap(phi - phases[0,0])
+    results['drift fit DC'] = abs(c - c0)/A0
+    results['drift fit drift'] = abs(d - d0)*t[-1]/A0
+    results['fit phase (for comparison)'] = wrap(fit(y, dt, f)[1] - \
+                                                 phases[0,0])
+
+    for key in sorted(results):
+        print(key + ": " + str(results[key]))
+
+    new_hits = basis_cache.stats()['hits'] - hits
+    print("basis cache hits on the second fit: " + str(new_hits))
+
+    failed = [key for key in results if results[key] > tolerance and \
+              not key.startswith('fit phase')]
+    if new_hits < 1:
+        failed.append('basis cache hit')
+    if failed:
+        raise Travisty("Oops! check_lsq failed: " + ", ".join(failed) + ".")
+
+    return results
+
+def fit_harmonics(Y,dt,f,num_harmonics=2,lsq=False):
+    # Fits the fundamental at f and the next num_harmonics harmonics (2f,
+    # 3f, ...) plus DC, for many traces in one pass: one matrix product of the
+    # traces with the basis of all frequencies. This costs about the same as a
+    # single fit. With lsq = False, the amplitudes and phases are those of
+    # fit_batch. With lsq = True, they are a least-squares fit of all
+    # harmonics together (see fit_lsq), which is exact for any trace length.
+    # Input parameters are:
+    # Y - digitizer traces, one per row, or a single 1D trace
+    # dt - time elapsed between each data point in SECONDS
+    # f - fundamental frequency in HERTZ
+    # num_harmonics - number of harmonics above the fundamental
+
+    Y = np.asarray(Y, dtype = float)
+    single = (Y.ndim == 1)
+    Y = np.atleast_2d(Y)
+
+    freqs = f*np.arange(1, num_harmonics + 2)
+
+    if lsq:
+        coeffs = lsq_coefficients(Y, dt, freqs)
+        a = coeffs[:,:len(freqs)]
+        b = coeffs[:,len(freqs):2*len(freqs)]
+        c = coeffs[:,2*len(freqs)]
+
+        A = np.sqrt(a**2 + b**2)
+        phi = (np.arctan2(b,a) + 2.0*pi) % (2.0*pi)
+    else:
+        A, phi, c = fit_batch(Y, dt, freqs)
+
+    # Total harmonic distortion: harmonic amplitudes relative to the
+    # fundamental
+    thd = np.sqrt(np.sum(A[:,1:]**2, axis = 1))/A[:,0]
+
+    # Returns: amplitudes A and phases phi with one row per trace and one
+    # column per frequency (fundamental first), DC offsets c and total
+    # harmonic distortions thd with one value per trace. For a 1D trace, A
+    # and phi have one value per frequency and c and thd are floats.
+    if single:
+        return A[0], phi[0], np.float(c[0]), np.float(thd[0])
+
+    return A, phi, c, thd
+
+def check_fit_harmonics(num_traces = 10, num_periods = 64, dt = 1e-6,
+                        f = 625., amplitudes = (1.0, 0.05, 0.02), c0 = 0.2,
+                        tolerance = 1e-8):
+    ''' Checks fit_harmonics on simulated traces with the given amplitudes
+    [V] at the fundamental f and its harmonics, random phases and a DC offset
+    c0, with lsq = False on a whole number of periods and with lsq = True on
+    traces a third of a period longer. Prints and returns the largest
+    differences from the known amplitudes and THD (relative to the
+    fundamental), phases [rad] and DC offsets, and raises a Travisty if any is
+    above tolerance.
+    '''
+
+    amplitudes = np.asarray(amplitudes, dtype = float)
+    num_harmonics = len(amplitudes) - 1
+    freqs = f*np.arange(1, num_harmonics + 2)
+    thd0 = np.sqrt(np.sum(amplitudes[1:]**2))/amplitudes[0]
+    phases = 2.0*pi*np.random.rand(num_traces, len(freqs))
+
+    def traces(num_samples):
+        t = np.arange(num_samples)*dt
+        Y = c0*np.ones((num_traces, num_samples))
+        for k in range(len(freqs)):
+            Y += amplitudes[k]*cos(2.0*pi*freqs[k]*t - phases[:,k:k+1])
+        return Y
+
+    wrap = lambda x: np.abs((x + pi) % (2.0*pi) - pi)
+    num_samples = int(round(num_periods/(f*dt)))
+
+    results = {}
+    for lsq, n in [(False, num_samples),
+                   (True, num_samples + int(round(1.0/(3*f*dt))))]:
+        A, phi, c, thd = fit_harmonics(traces(n), dt, f,
+                                       num_harmonics = num_harmonics,
+                                       lsq = lsq)
+
+        label = 'lsq ' if lsq else 'projection '
+        results[label + 'amplitude'] = \
+            np.max(np.abs(A - amplitudes))/amplitudes[0]
+        # A harmonic that is not there has no phase
+        present = amplitudes > 0
+        results[label + 'phase'] = \
+            np.max(wrap(phi - phases)[:,present])
+        results[label + 'DC'] = np.max(np.abs(c - c0))/amplitudes[0]
+        results[label + 'THD'] = np.max(np.abs(thd - thd0))
+
+    for key in sorted(results):
+        print(key + ": " + str(results[key]))
+
+    failed = [key for key in results if results[key] > tolerance]
+    if failed:
+        raise Travisty("Oops! check_fit_harmonics failed: " + \
+                       ", ".join(failed) + ".")
+
+    return results
+
+def fit_int16(Y,dt,freqs,scale=1.0,chunk_size=1024):
+    # Same as fit_batch for raw 16-bit digitizer traces, without converting
+    # them to volts first. Each chunk of chunk_size samples is converted to
+    # 32-bit floats and multiplied with a 32-bit basis, and the chunks are
+    # summed in 64-bit floats. The scale (volts per ADC code, i.e. the channel
+    # range/digitizer.ADC_FULL_SCALE) is only applied to the final amplitudes
+    # and DC offsets. Phases agree with fit to better than 1e-6 rad.
+    # Input parameters are:
+    # Y - digitizer traces of 16-bit integers. The last axis is time, so a 1D
+    #     trace, 2D traces (one per row) or any other shape works.
+    # dt - time elapsed between each data point in SECONDS
+    # freqs - list of frequencies of interest in HERTZ
+    # scale - number to multiply amplitudes and DC offsets by
+
+    Y = np.asarray(Y)
+    data_length = Y.shape[-1]
+    num_freqs = len(np.atleast_1d(freqs))
+
+    basis = basis_cache.get(data_length, dt, freqs, dtype = np.float32)
+
+    P = np.zeros(Y.shape[:-1] + (2*num_freqs,))
+    for i in range(0, data_length, chunk_size):
+        P += np.dot(Y[...,i:i+chunk_size].astype(np.float32),
+                    basis[i:i+chunk_size])
+
+    # Integer sum, exact
+    c = Y.sum(axis = -1, dtype = np.int64)*(scale/data_length)
+
+    P *= 2.0/data_length
+    a = P[...,:num_freqs]
+    b = P[...,num_freqs:]
+
+    A = np.sqrt(a**2 + b**2)*scale
+    phi = (np.arctan2(b,a) + 2.0*pi) % (2.0*pi)
+
+    # Returns: amplitudes A and phases phi with the shape of Y, except for a
+    # last axis with one value per frequency, and DC offsets c with the shape
+    # of Y without its last axis.
+    return A, phi, c
+
+def benchmark_fit_int16(num_traces = 100, num_samples = 100000, dt = 1e-6,
+                        f = 625., scale = 8./32767):
+    ''' Compares fit_int16 on simulated 16-bit traces with fit on the same
+    traces in volts. Prints and returns the times [s] and the largest
+    differences in amplitude [V], phase [rad] and DC offset [V].
+    '''
+
+    t = np.arange(num_samples)*dt
+    phases = 2.0*pi*np.random.rand(num_traces, 1)
+    Y = 3000.*cos(2.0*pi*f*t + phases) + 200. + \
+        20.*np.random.randn(num_traces, num_samples)
+    Y = np.round(Y).astype(np.int16)
+
+    t_s = time.time()
+    A, phi, c = fit_int16(Y, dt, [f], scale = scale)
+    t_int = time.time() - t_s
+
+    t_s = time.time()
+    V = Y*scale
+    ref = np.array([fit(y, dt, f) for y in V])
+    t_fit = time.time() - t_s
+
+    dphi = np.abs((phi[:,0] - ref[:,1] + pi) % (2.0*pi) - pi)
+    results = {'fit_int16 time' : t_int,
+               'fit time' : t_fit,
+               'amplitude difference' : np.max(np.abs(A[:,0] - ref[:,0])),
+               'phase difference' : np.max(dphi),
+               'DC difference' : np.max(np.abs(c - ref[:,2]))}
+
+    for key in sorted(results):
+        print(key + ": " + str(results[key]))
+
+    return results
+
 def quench_arrays(quench_file):
 
     openq = [ind for ind in quench_file.index if quench_file.ix[ind]['Open']]
@@ -159,6 +588,104 @@ def make_comment_string(run_dict, rd_order):
 
     return comment_string + "\n"
 
+def read_comment_string(filename):
+    ''' Reads the comment section at the top of a data file, written by
+    make_comment_string, back into a dict of strings.
+    '''
+
+    comments = {}
+
+    with open(filename, 'r') as f:
+        for line in f:
+            if not line.startswith('#'):
+                break
+
+            key, sep, value = line[1:].strip().partition(' = ')
+            if sep:
+                comments[key] = value
+
+    return comments
+
+def load_run(folder, use_cache = True):
+    ''' Loads the data.txt of a run. Returns the data as a DataFrame, with the
+    dtype of each column inferred from its values, and the comment header as
+    a dict of strings (see read_comment_string). The header can have any
+    number of lines.
+
+    The result is cached in 'data cache.pkl' next to data.txt, along with the
+    size and modification time of data.txt. Later loads use the cache as
+    long as data.txt has not changed.
+    '''
+
+    data_file = os.path.join(folder, 'data.txt')
+    cache_file = os.path.join(folder, 'data cache.pkl')
+    st = os.stat(data_file)
+    stamp = (st.st_size, st.st_mtime)
+
+    if use_cache and os.path.exists(cache_file):
+        try:
+            cached_stamp, header, data = pd.read_pickle(cache_file)
+            if tuple(cached_stamp) == stamp:
+                return data, header
+        except Exception as e:
+            # Unreadable cache (e.g. made by another pandas version)
+            print("Could not read " + cache_file + " (" + \
+                  type(e).__name__ + ": " + str(e) + "). Rebuilding it.")
+
+    header = read_comment_string(data_file)
+
+    num_comments = 0
+    with open(data_file, 'r') as f:
+        for line in f:
+            if not line.startswith('#'):
+                break
+            num_comments += 1
+
+    data = pd.read_csv(data_file, skiprows = num_comments)
+
+    if use_cache:
+        # Written to a new file first, so a stopped load never leaves a
+        # broken cache
+        temp = cache_file + '.new'
+        pd.to_pickle((stamp, header, data), temp)
+        if os.path.exists(cache_file):
+            os.remove(cache_file)
+        os.rename(temp, cache_file)
+
+    return data, header
+
+def load_data_columns(folder):
+    ''' Memory-maps the binary copy of a run's data.txt. folder is the run's
+    data folder or the binary copy itself. Returns an ordered dict with an
+    array for each column of data.txt, and the run dictionary as a dict of
+    strings. Nothing is read until the arrays are used. Rows that were only
+    partly written (if the run stopped during a write) are left out.
+    '''
+
+    if os.path.exists(os.path.join(folder, DATA_COLUMNS_FOLDER)):
+        folder = os.path.join(folder, DATA_COLUMNS_FOLDER)
+
+    with open(os.path.join(folder, 'schema.json'), 'r') as f:
+        schema = json.load(f)
+
+    dtypes = [np.dtype(str(col['dtype'])) for col in schema['columns']]
+    paths = [os.path.join(folder, col['file']) for col in schema['columns']]
+
+    num_rows = 0
+    if len(paths) > 0:
+        num_rows = min(os.path.getsize(path) // dtype.itemsize \
+                       for path, dtype in zip(paths, dtypes))
+
+    columns = collections.OrderedDict()
+    for col, dtype, path in zip(schema['columns'], dtypes, paths):
+        if num_rows == 0:
+            columns[col['name']] = np.zeros(0, dtype = dtype)
+        else:
+            columns[col['name']] = np.memmap(path, dtype = dtype, mode = 'r',
+                                             shape = (num_rows,))
+
+    return columns, schema['run dictionary']
+
 def load_run_dictionary(filename, quenchfilename):
     ''' Creates a run dictionary by loading the files specified. Will return the
     run dictionary itself as well as a list with which to order the columns in
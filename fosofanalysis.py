@@ -0,0 +1,637 @@
+''' Phase analysis of the traces saved by FOSOFAcquisition. Every acquisition
+saves four traces, named as in fosof_acquisition.make_filename and ending in:
+    _01 - detector (detector digitizer)
+    _02 - power combiner on the detector digitizer
+    _03 - other power combiner (second digitizer)
+    _04 - same power combiner as _02 (second digitizer)
+
+For each acquisition, the amplitude and phase of every trace at the offset
+frequency are found with fosof_qol.fit_int16, along with the phase of the
+detector relative to the combiner on the same digitizer and the phase between
+the two combiners. The results are written to a table in the run's data
+folder, one row per acquisition, keyed by the 'Detector Trace Filename' column
+of data.txt. With num_harmonics > 0, every trace is instead fitted at the
+offset frequency and its first harmonics in one pass with
+fosof_qol.fit_harmonics, and the total harmonic distortion of each trace is
+added to the table as a check for nonlinearity.
+
+AnalysisDaemon watches a run's binary folder while the run is going and only
+analyzes new traces. It keeps a checkpoint, so a restarted daemon picks up
+where it stopped. analyze_run does a whole run at once. Both hand blocks of
+acquisitions to analyze_blocks, which spreads them over a pool of processes.
+
+PhaseWorker analyzes the traces during the run, in a process of its own, so
+problems show up while the run is going.
+'''
+from __future__ import division
+import os
+import sys
+import time
+import json
+import collections
+import tempfile
+import shutil
+import multiprocessing as mp
+import numpy as np
+import pandas as pd
+import fosof_qol as qol
+import binary
+import tracearchive
+
+try:
+    from queue import Full
+except ImportError:
+    from Queue import Full
+
+# Same as digitizer.ADC_FULL_SCALE. The digitizer module needs VISA to import.
+ADC_FULL_SCALE = 32767
+
+_RESULTS_FILE_ = 'phases.txt'
+_CHECKPOINT_FILE_ = 'phases checkpoint.json'
+_LIVE_RESULTS_FILE_ = 'phases in run.txt'
+
+# Trace name ending -> name in the results table
+CHANNELS = [('_01', 'Detector'),
+            ('_02', 'Combiner Digi 1'),
+            ('_03', 'Other Combiner Digi 2'),
+            ('_04', 'Combiner Digi 2')]
+
+def acquisition_name(trace_name):
+    ''' Name of the acquisition a trace belongs to (without _0n).'''
+    return trace_name[:-3]
+
+def analyze_acquisition(traces, dt, offset_freq, scale, num_harmonics = 0):
+    ''' Returns a dict with the amplitudes [V] and phases [rad] of the four
+    16-bit traces of one acquisition (in channel order, see CHANNELS) at
+    offset_freq [Hz], and the phase differences. If num_harmonics > 0, the
+    traces are fitted with that many harmonics and the total harmonic
+    distortion of each trace is added.
+    '''
+
+    lengths = set(len(V) for V in traces)
+    if num_harmonics > 0:
+        # The fundamental comes from the same pass as the harmonics
+        if len(lengths) == 1:
+            A, phi, c, thd = qol.fit_harmonics(np.vstack(traces), dt,
+                                               offset_freq,
+                                               num_harmonics = num_harmonics)
+        else:
+            fits = [qol.fit_harmonics(V, dt, offset_freq,
+                                      num_harmonics = num_harmonics) \
+                    for V in traces]
+            A = np.array([f[0] for f in fits])
+            phi = np.array([f[1] for f in fits])
+            thd = np.array([f[3] for f in fits])
+        A = A * scale
+    elif len(lengths) == 1:
+        A, phi, c = qol.fit_int16(np.vstack(traces), dt, [offset_freq],
+                                  scale = scale)
+    else:
+        fits = [qol.fit_int16(V, dt, [offset_freq], scale = scale) \
+                for V in traces]
+        A = np.array([f[0] for f in fits])
+        phi = np.array([f[1] for f in fits])
+
+    row = {}
+    for i, (ending, name) in enumerate(CHANNELS):
+        row[name + ' Amplitude [V]'] = A[i,0]
+        row[name + ' Phase [rad]'] = phi[i,0]
+        if num_harmonics > 0:
+            row[name + ' THD'] = thd[i]
+
+    # Phases relative to a trace on the same digitizer, so the digitizer
+    # timing drops out
+    row['Detector - Combiner Digi 1 Phase [rad]'] = \
+        (phi[0,0] - phi[1,0]) % (2.*np.pi)
+    row['Other Combiner - Combiner Digi 2 Phase [rad]'] = \
+        (phi[2,0] - phi[3,0]) % (2.*np.pi)
+
+    return row
+
+def analyze_traces(name, traces, dt, scale, offset_freq, num_harmonics = 0):
+    ''' Returns the result row of the acquisition with the given name (without
+    _0n) and four 16-bit traces. The settings in the name are added to the
+    row (see binary.parse_trace_name).
+    '''
+
+    row = analyze_acquisition(traces, dt, offset_freq, scale,
+                              num_harmonics = num_harmonics)
+
+    row['Detector Trace Filename'] = name + CHANNELS[0][0]
+    info = binary.parse_trace_name(name + CHANNELS[0][0])
+    if info is not None:
+        row['Repeat'] = info['rep']
+        row['Average'] = info['avg']
+        row['Configuration'] = info['config']
+        row['Waveguide Carrier Frequency [MHz]'] = info['freq']
+        row['Pre-Quench 910 State'] = info['pre910']
+    row['Offset Frequency [Hz]'] = offset_freq
+
+    return row
+
+def analyze_block(args):
+    ''' Analyzes a block of acquisitions. Run in the worker processes of
+    analyze_blocks, so it only takes picklable arguments:
+    (source, names, locations, dt, scale, offset_freqs, num_harmonics), where
+    source is a trace archive or a folder of .npy files, names are acquisition
+    names, locations has where the four traces of each acquisition are (the
+    offset, nbytes and codec of each trace from the archive index, or the .npy
+    files) and offset_freqs has the offset frequency [Hz] of each
+    acquisition. The archive is not indexed again here. Returns a list of
+    result rows.
+    '''
+
+    source, names, locations, dt, scale, offset_freqs, num_harmonics = args
+
+    trc = None
+    if source.endswith('.trc'):
+        trc = open(source, 'rb')
+        load = lambda loc: tracearchive.read_trace(trc, *loc)
+    else:
+        load = lambda loc: np.load(loc, mmap_mode = 'r')
+
+    rows = []
+    try:
+        for name, locs, offset_freq in zip(names, locations, offset_freqs):
+            traces = [load(loc) for loc in locs]
+            rows.append(analyze_traces(name, traces, dt, scale, offset_freq,
+                                       num_harmonics = num_harmonics))
+    finally:
+        if trc is not None:
+            trc.close()
+
+    return rows
+
+def analyze_blocks(blocks, num_processes = 1):
+    ''' Analyzes blocks of acquisitions (see analyze_block for the arguments
+    of each block) on a pool of num_processes processes, each taking one
+    block at a time. Returns the result rows of all blocks, in order.
+    '''
+
+    if num_processes > 1 and len(blocks) > 1:
+        pool = mp.Pool(min(num_processes, len(blocks)))
+        try:
+            results = pool.map(analyze_block, blocks, chunksize = 1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [analyze_block(block) for block in blocks]
+
+    return [row for block in results for row in block]
+
+def write_results(filename, rows, num_harmonics = 0):
+    ''' Appends result rows to a results table, with a header if the file is
+    new. num_harmonics must be the same for all rows of a table, since it
+    adds the THD columns.
+    '''
+
+    columns = ['Detector Trace Filename', 'Repeat', 'Average',
+               'Configuration', 'Waveguide Carrier Frequency [MHz]',
+               'Offset Frequency [Hz]', 'Pre-Quench 910 State']
+    for ending, name in CHANNELS:
+        columns += [name + ' Amplitude [V]', name + ' Phase [rad]']
+    if num_harmonics > 0:
+        columns += [name + ' THD' for ending, name in CHANNELS]
+    columns += ['Detector - Combiner Digi 1 Phase [rad]',
+                'Other Combiner - Combiner Digi 2 Phase [rad]']
+
+    table = pd.DataFrame(rows, columns = columns)
+    new_file = not os.path.exists(filename)
+
+    with open(filename, 'a') as f:
+        table.to_csv(f, header = new_file, index = False)
+        f.flush()
+        os.fsync(f.fileno())
+
+class AnalysisDaemon(object):
+    ''' Analyzes the traces of a FOSOF run as they are saved. bin_folder is the
+    run's binary folder and data_folder the folder with its data.txt, where
+    the results (phases.txt) and the checkpoint are written.
+
+    Each poll checks the size and modification time of the trace archive (or
+    of the folder for runs saved as .npy files), and does nothing if they have
+    not changed. Otherwise, only the record headers written since the last
+    poll are read (or only the new .npy files are looked at), and the
+    acquisitions with all four traces that are not in the checkpoint are
+    analyzed, with num_processes processes in blocks of block_size
+    acquisitions. Their results are appended. .npy files modified less than
+    settle seconds ago are left for a later poll, since they may still be
+    being written. See analyze_acquisition for num_harmonics.
+    '''
+
+    def __init__(self, bin_folder, data_folder, num_processes = 1,
+                 block_size = 64, settle = 2.0, num_harmonics = 0):
+        self.bin_folder = bin_folder
+        self.data_folder = data_folder
+        self.num_processes = num_processes
+        self.block_size = block_size
+        self.settle = settle
+        self.num_harmonics = num_harmonics
+
+        self.results_file = os.path.join(data_folder, _RESULTS_FILE_)
+        self.checkpoint_file = os.path.join(data_folder, _CHECKPOINT_FILE_)
+
+        self.archive = os.path.join(bin_folder, 'traces.trc')
+        if not os.path.exists(self.archive):
+            self.archive = None
+
+        # Run settings from the comment header of data.txt
+        header = qol.read_comment_string(os.path.join(data_folder, 'data.txt'))
+        self.dt = 1. / float(header['Digitizer Sampling Rate [S/s]'])
+        self.scale = float(header['Digitizer Channel Range [V]']) / \
+                     ADC_FULL_SCALE
+        self.offset_freqs = [float(of) for of \
+                             in header['Offset Frequency [Hz]'].split(',')]
+
+        self.processed = set()
+        self.stamp = None
+        self.index_pos = None # Next record header of the archive to read
+        self.seen = set() # .npy files found so far
+        self.settling = False # Are .npy files still being written?
+
+        # Traces found of acquisitions that are not complete yet, by ending
+        self.waiting = collections.OrderedDict()
+
+        self.load_checkpoint()
+
+    def load_checkpoint(self):
+        ''' Reads the acquisitions already analyzed. Any rows written to the
+        results after the last checkpoint (if the daemon stopped in between)
+        are counted too, so they are not analyzed twice.
+        '''
+
+        if os.path.exists(self.checkpoint_file):
+            with open(self.checkpoint_file, 'r') as f:
+                checkpoint = json.load(f)
+            self.processed = set(checkpoint['processed'])
+            if self.archive is not None and \
+               checkpoint.get('index position') is not None and \
+               checkpoint['index position'] <= os.path.getsize(self.archive):
+                self.index_pos = checkpoint['index position']
+
+        if os.path.exists(self.results_file):
+            done = pd.read_csv(self.results_file,
+                               usecols = ['Detector Trace Filename'])
+            self.processed.update(acquisition_name(name) for name \
+                                  in done['Detector Trace Filename'])
+
+    def save_checkpoint(self):
+        ''' Writes the checkpoint to a new file and then replaces the old one,
+        so there is always a complete checkpoint on disk.
+        '''
+
+        # A restarted daemon reads the archive from the first record of any
+        # acquisition that is not complete yet
+        index_pos = self.index_pos
+        for locs in self.waiting.values():
+            for loc in locs.values():
+                if not isinstance(loc, basestring):
+                    index_pos = min(index_pos,
+                                    loc[0] - tracearchive.RECORD_DTYPE.itemsize)
+
+        temp = self.checkpoint_file + '.new'
+        with open(temp, 'w') as f:
+            json.dump({'processed' : sorted(self.processed),
+                       'index position' : index_pos,
+                       'time' : time.time()}, f)
+            f.flush()
+            os.fsync(f.fileno())
+
+        if os.path.exists(self.checkpoint_file):
+            os.remove(self.checkpoint_file)
+        os.rename(temp, self.checkpoint_file)
+
+    def get_stamp(self):
+        ''' Size and modification time of what is watched.'''
+
+        path = self.archive if self.archive is not None else self.bin_folder
+        st = os.stat(path)
+        return (st.st_size, st.st_mtime)
+
+    def scan(self):
+        ''' Returns the names and locations of the traces saved since the last
+        scan. For an archive, the location is the offset, nbytes and codec of
+        the trace, and only the record headers after the last one read are
+        read. For .npy files, it is the file, and only files that have not
+        been found before are looked at. Files modified less than settle
+        seconds ago are left for a later scan.
+        '''
+
+        if self.archive is not None:
+            index, self.index_pos = tracearchive.read_index(self.archive,
+                                                            self.index_pos)
+            return [(row['name'], (int(row['offset']), int(row['nbytes']),
+                                   row['codec'])) for row in index]
+
+        now = time.time()
+        self.settling = False
+        found = []
+        for f in os.listdir(self.bin_folder):
+            if not f.endswith('.digi.npy') or f in self.seen:
+                continue
+
+            path = os.path.join(self.bin_folder, f)
+            if now - os.path.getmtime(path) <= self.settle:
+                self.settling = True
+                continue
+
+            self.seen.add(f)
+            found.append((binary.parse_name(f), path))
+
+        return found
+
+    def find_new(self):
+        ''' Returns the names of the acquisitions with all four traces saved
+        that have not been analyzed, in the order they were saved, and the
+        locations of their traces (see scan).
+        '''
+
+        endings = [ending for ending, channel in CHANNELS]
+        for name, loc in self.scan():
+            if not name[-3:] in endings:
+                continue
+
+            acq = acquisition_name(name)
+            if acq in self.processed:
+                continue
+
+            if not acq in self.waiting:
+                self.waiting[acq] = {}
+            self.waiting[acq][name[-3:]] = loc
+
+        return [(acq, [locs[e] for e in endings]) for acq, locs \
+                in self.waiting.items() if len(locs) == len(CHANNELS)]
+
+    def offset_frequency(self, name):
+        ''' Offset frequency of an acquisition. It is only in the trace name
+        if the run has more than one.
+        '''
+
+        info = binary.parse_trace_name(name + CHANNELS[0][0])
+        if info is not None and info['offset_freq'] is not None:
+            return float(info['offset_freq'])
+
+        return self.offset_freqs[0]
+
+    def poll(self):
+        ''' Analyzes any new acquisitions. Returns how many there were.'''
+
+        stamp = self.get_stamp()
+        if stamp == self.stamp:
+            return 0
+
+        new = self.find_new()
+        source = self.archive if self.archive is not None else self.bin_folder
+
+        blocks = []
+        for i in range(0, len(new), self.block_size):
+            names = [acq for acq, locs in new[i:i + self.block_size]]
+            locations = [locs for acq, locs in new[i:i + self.block_size]]
+            blocks.append((source, names, locations, self.dt, self.scale,
+                           [self.offset_frequency(n) for n in names],
+                           self.num_harmonics))
+
+        rows = analyze_blocks(blocks, self.num_processes)
+        if len(rows) > 0:
+            write_results(self.results_file, rows,
+                          num_harmonics = self.num_harmonics)
+            for acq, locs in new:
+                self.processed.add(acq)
+                del self.waiting[acq]
+            self.save_checkpoint()
+
+        # The folder does not change when files still being written are
+        # finished, so it has to be looked at again until they have settled
+        if not self.settling:
+            self.stamp = stamp
+
+        return len(rows)
+
+    def run(self, interval = 10.0):
+        ''' Polls every interval seconds until interrupted (Ctrl+C).'''
+
+        print("Watching " + self.bin_folder)
+        try:
+            while True:
+                t_s = time.time()
+                n = self.poll()
+                if n > 0:
+                    print(str(n) + " acquisitions analyzed in " + \
+                          str(round(time.time() - t_s, 2)) + " s. " + \
+                          str(len(self.processed)) + " in total.")
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            print("Stopped.")
+
+def _phase_worker(queue, results_file, dt, scale, num_done):
+    ''' Loop run by the PhaseWorker process.'''
+
+    while True:
+        item = queue.get()
+        if item is None:
+            break
+
+        name, traces, offset_freq = item
+        try:
+            row = analyze_traces(name, traces, dt, scale, offset_freq)
+            write_results(results_file, [row])
+            with num_done.get_lock():
+                num_done.value += 1
+        except Exception as e:
+            sys.stderr.write("Oops! Could not analyze " + name + ": " + \
+                             str(e) + "\n")
+
+class PhaseWorker(object):
+    ''' Analyzes the traces of each acquisition in a separate process while a
+    run is going, and appends the results to 'phases in run.txt' in the
+    run's data folder (same columns as phases.txt). dt is the time between
+    samples [s] and scale the volts per ADC code.
+
+    submit never waits. If the worker is still busy with max_queue
+    acquisitions, the new one is skipped and the skip is reported. Skipped
+    acquisitions can be analyzed after the run with analyze_run.
+    '''
+
+    def __init__(self, data_folder, dt, scale, max_queue = 4):
+        self.results_file = os.path.join(data_folder, _LIVE_RESULTS_FILE_)
+        self.queue = mp.Queue(max_queue)
+        self.num_submitted = 0
+        self.num_skipped = 0
+        self.num_done = mp.Value('i', 0)
+
+        self.process = mp.Process(target = _phase_worker,
+                                  args = (self.queue, self.results_file, dt,
+                                          scale, self.num_done))
+        self.process.daemon = True
+        self.process.start()
+
+    def submit(self, name, traces, offset_freq):
+        ''' Hands the four traces of acquisition name (without _0n, traces in
+        channel order, see CHANNELS) to the worker. Returns False if it was
+        skipped.
+        '''
+
+        # The traces may be views of digitizer buffers that are reused, so
+        # they are copied here. Pickling happens on the queue's own thread.
+        traces = [np.array(V) for V in traces]
+        try:
+            self.queue.put_nowait((name, traces, float(offset_freq)))
+        except Full:
+            self.num_skipped += 1
+            print("Phase worker is behind. Skipped " + name + " (" + \
+                  str(self.num_skipped) + " skipped so far).")
+            return False
+
+        self.num_submitted += 1
+        return True
+
+    def get_stats(self):
+        ''' Returns a dict with the number of acquisitions submitted, analyzed
+        and skipped so far.
+        '''
+
+        return {'submitted' : self.num_submitted,
+                'analyzed' : self.num_done.value,
+                'skipped' : self.num_skipped}
+
+    def close(self, timeout = 30.0):
+        ''' Lets the worker finish the acquisitions it has, then stops it.'''
+
+        if not self.process.is_alive():
+            return
+
+        try:
+            self.queue.put(None, timeout = timeout)
+        except Full:
+            pass
+        self.process.join(timeout)
+
+        if self.process.is_alive():
+            sys.stderr.write("Oops! The phase worker did not stop. " + \
+                             "Terminating it.\n")
+            self.process.terminate()
+
+def analyze_run(bin_folder, data_folder, num_processes = None,
+                block_size = 64, num_harmonics = 0):
+    ''' Analyzes every acquisition of a run that has not been analyzed yet,
+    with num_processes processes (one per core by default) in blocks of
+    block_size acquisitions. See analyze_acquisition for num_harmonics.
+    Returns the table of results.
+    '''
+
+    if num_processes is None:
+        num_processes = mp.cpu_count()
+
+    daemon = AnalysisDaemon(bin_folder, data_folder,
+                            num_processes = num_processes,
+                            block_size = block_size, settle = 0.0,
+                            num_harmonics = num_harmonics)
+    daemon.poll()
+
+    return pd.read_csv(daemon.results_file)
+
+def test_daemon(settle = 0.5):
+    ''' Checks AnalysisDaemon on made-up traces in a temporary folder: .npy
+    files are analyzed once they have settled, an archive is read only from
+    where the last poll stopped, a restarted daemon does not analyze anything
+    twice, and fitting harmonics gives the same phase differences. Raises an
+    AssertionError if something is wrong.
+    '''
+
+    folder = tempfile.mkdtemp()
+    try:
+        bin_folder = os.path.join(folder, 'bin')
+        os.mkdir(bin_folder)
+        with open(os.path.join(folder, 'data.txt'), 'w') as f:
+            f.write("# Offset Frequency [Hz] = 625\n" + \
+                    "# Digitizer Sampling Rate [S/s] = 800000\n" + \
+                    "# Digitizer Channel Range [V] = 2\n")
+
+        # 10 cycles of the offset frequency. The detector is 0.7 rad ahead of
+        # the combiner.
+        t = np.arange(12800) / 800000.
+        phases = [1.7, 1.0, 2.0, 1.5]
+        traces = [np.round(1000.*np.cos(2.*np.pi*625.*t + phase)) \
+                    .astype(np.int16) for phase in phases]
+        names = ['r001a%03df0910.0chA' % (i + 1) for i in range(4)]
+
+        # .npy files still being written are left until they have settled
+        for ending, V in zip([e for e, c in CHANNELS], traces):
+            np.save(os.path.join(bin_folder, names[0] + ending + '.digi.npy'),
+                    V)
+        daemon = AnalysisDaemon(bin_folder, folder, settle = settle)
+        assert daemon.poll() == 0
+        time.sleep(1.5*settle)
+        assert daemon.poll() == 1
+        assert daemon.poll() == 0
+
+        results = pd.read_csv(daemon.results_file)
+        assert abs(results['Detector - Combiner Digi 1 Phase [rad]'][0] - \
+                   (2.*np.pi - 0.7)) < 1e-4
+        os.remove(daemon.results_file)
+        os.remove(daemon.checkpoint_file)
+        shutil.rmtree(bin_folder)
+        os.mkdir(bin_folder)
+
+        # Archive
+        writer = tracearchive.TraceWriter(os.path.join(bin_folder,
+                                                       'traces.trc'))
+        def write(name, endings):
+            for ending in endings:
+                i = [e for e, c in CHANNELS].index(ending)
+                writer.append(traces[i], name = name + ending, channel = i + 1)
+            writer.flush()
+
+        write(names[0], ['_01', '_02', '_03', '_04'])
+        write(names[1], ['_01', '_02', '_03', '_04'])
+        daemon = AnalysisDaemon(bin_folder, folder)
+        assert daemon.poll() == 2
+        end = daemon.index_pos
+
+        write(names[2], ['_01', '_02'])
+        assert daemon.poll() == 0
+        assert daemon.index_pos > end
+
+        # A restart carries on from the incomplete acquisition
+        write(names[2], ['_03', '_04'])
+        write(names[3], ['_01', '_02', '_03', '_04'])
+        daemon = AnalysisDaemon(bin_folder, folder)
+        assert daemon.index_pos is not None and daemon.index_pos > 0
+        assert daemon.poll() == 2
+        assert daemon.poll() == 0
+        writer.close()
+
+        results = pd.read_csv(daemon.results_file)
+        assert sorted(results['Detector Trace Filename']) == \
+               [name + '_01' for name in names]
+
+        # Harmonics, on pure sine waves
+        row = analyze_acquisition(traces, t[1], 625., 2. / ADC_FULL_SCALE,
+                                  num_harmonics = 2)
+        assert row['Detector THD'] < 1e-3
+        assert abs(row['Detector - Combiner Digi 1 Phase [rad]'] - \
+                   (2.*np.pi - 0.7)) < 1e-4
+    finally:
+        shutil.rmtree(folder)
+
+    print("AnalysisDaemon passed.")
+
+    return True
+
+def main():
+    # Usage: python fosofanalysis.py "binary folder" "data folder" [watch]
+    bin_folder = sys.argv[1]
+    data_folder = sys.argv[2]
+
+    if len(sys.argv) > 3 and sys.argv[3] == 'watch':
+        AnalysisDaemon(bin_folder, data_folder,
+                       num_processes = mp.cpu_count()).run()
+    else:
+        t_s = time.time()
+        results = analyze_run(bin_folder, data_folder)
+        print(str(len(results)) + " acquisitions analyzed in " + \
+              str(round(time.time() - t_s, 2)) + " s.")
+
+if __name__ == '__main__':
+    main()
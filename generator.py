@@ -8,22 +8,10 @@ import os
 import LabJackPython
 import struct
 import time
+import devicedata
 
-_DEFAULT_FILE_LOCATION_ = "C:/DEVICEDATA/"
-info_file = pd.read_csv(_DEFAULT_FILE_LOCATION_ + "generator.csv")
-_OFFSET_DEFAULT_ = int(info_file['Default Offset Frequency [Hz]'].values[0])
-_RANGE_DEFAULT_ = info_file['Default Scan Range'].values[0]
-_E_FIELD_DEFAULT_ = int(info_file['Default Peak Electric Field Amplitude [V/cm]'] \
-                                 .values[0])
-
-_GPIB_ = int(info_file["GPIB Address"].values[0])
-_COM_ = int(info_file["COM Port"].values[0])
-_KEITHLEY_COM_ = int(info_file["Keithley COM Port"].values[0])
-_CALIBRATION_FOLDER_ = info_file["Calibration Folder"].values[0]
-_BLIND_FILE_ = info_file["Blind File"].values[0]
-_JITTERS_FILE_ = info_file["Jitters File"].values[0]
-_KEITHLEY_CH_A_ = int(info_file["Keithley Channel A"].values[0])
-_KEITHLEY_CH_B_ = int(info_file["Keithley Channel B"].values[0])
+# Generator settings, read from C:/DEVICEDATA/generator.csv when first needed
+info_file = devicedata.Settings('generator')
 
 class Generator(object):
     ''' A class to control the RF generator for the FOSOF waveguides in the
@@ -36,19 +24,29 @@ class Generator(object):
     acquisition.
     '''
 
-    def __init__(self, calib = False, offset_freq = _OFFSET_DEFAULT_, \
-                 scan_range = _RANGE_DEFAULT_, e_field = _E_FIELD_DEFAULT_, \
+    def __init__(self, calib = False, offset_freq = None, \
+                 scan_range = None, e_field = None, \
                  a_on = True, b_on = True):
         ''' Opens the generator using the COM port specified in the global
         variables. The 'calib' variable controls whether or not the blind
         offset is applied to the frequency and whether the user can change the
         power directly or if they must specify an electric field amplitude to
-        use.
+        use. Settings left as None take the default from generator.csv.
         '''
 
-        self.gpib_address = _GPIB_
-        self.com_port = _COM_
-        self.keithley_com = _KEITHLEY_COM_
+        if offset_freq is None:
+            offset_freq = info_file.get('Default Offset Frequency [Hz]', int)
+        if scan_range is None:
+            scan_range = info_file['Default Scan Range']
+        if e_field is None:
+            e_field = info_file.get('Default Peak Electric Field ' + \
+                                    'Amplitude [V/cm]', int)
+
+        self.gpib_address = info_file.get("GPIB Address", int)
+        self.com_port = info_file.get("COM Port", int)
+        self.keithley_com = info_file.get("Keithley COM Port", int)
+        self.keithley_ch_a = info_file.get("Keithley Channel A", int)
+        self.keithley_ch_b = info_file.get("Keithley Channel B", int)
 
         if isinstance(calib, bool):
             self.calib_mode = calib
@@ -79,13 +77,13 @@ class Generator(object):
         # different value to every carrier frequency. They protect us from
         # seeing the blind if we were to look at the generator output. In
         # addition to the jitters, the generator display is blanked (see below).
-        self.blind = np.load(_BLIND_FILE_) # [MHz]
-        self.jitters = np.loadtxt(_JITTERS_FILE_) # [MHz]
+        self.blind = np.load(info_file["Blind File"]) # [MHz]
+        self.jitters = np.loadtxt(info_file["Jitters File"]) # [MHz]
 
         # The waveguide calibration files should be generated previously and
         # placed in the location listed in the global variables. The scan
         # ranges are listed as small, medium, large and extra large.
-        ranges = info_file["Scan Ranges"].values[0].split(";")
+        ranges = info_file["Scan Ranges"].split(";")
         if isinstance(scan_range, str):
             if scan_range in ['small', 'medium', 'large', 'extralarge']:
                 self.scan_range = scan_range
@@ -118,7 +116,7 @@ class Generator(object):
         # Open calibration files
 
         try:
-            self.calib_A = pd.read_csv(_CALIBRATION_FOLDER_ + \
+            self.calib_A = pd.read_csv(info_file["Calibration Folder"] + \
                                        self.scan_range + "/" + \
                                        self.calib_file_name_A, sep = "\t")
         except IOError as e:
@@ -127,7 +125,7 @@ class Generator(object):
             raise(e)
 
         try:
-            self.calib_B = pd.read_csv(_CALIBRATION_FOLDER_ + \
+            self.calib_B = pd.read_csv(info_file["Calibration Folder"] + \
                                        self.scan_range + "/" + \
                                        self.calib_file_name_B, sep = "\t")
         except IOError as e:
@@ -197,11 +195,11 @@ class Generator(object):
 
         if channel == 'A':
             self.logger.write("MEASure:VOLTage? (@" + \
-                             str(_KEITHLEY_CH_A_) + \
+                             str(self.keithley_ch_a) + \
                              ")\n")
         else:
             self.logger.write("MEASure:VOLTage? (@" + \
-                              str(_KEITHLEY_CH_B_) + \
+                              str(self.keithley_ch_b) + \
                               ")\n")
 
         rf_sensor_voltage = self.logger.readline()
@@ -1,11 +1,9 @@
 from __future__ import division
 import serial
-import pandas as pd
+import devicedata
 
-_DEFAULT_FILE_LOCATION_ = "C:/DEVICEDATA/"
-info_file = pd.read_csv(_DEFAULT_FILE_LOCATION_ + "flowcontroller.csv")
-ch1_default_setpoint = info_file["Charge Exchange Default Setpoint"].values[0]
-ch2_default_setpoint = info_file["Detector Default Setpoint"].values[0]
+# Default setpoints, read from C:/DEVICEDATA/flowcontroller.csv when needed
+info_file = devicedata.Settings('flowcontroller')
 
 class MKSFlowController(object):
 
@@ -38,12 +36,12 @@ class MKSFlowController(object):
         if self.is_setpoint(setpoint1):
             self.ch1_setpoint = round(setpoint1,1)
         else:
-            self.ch1_setpoint = ch1_default_setpoint
+            self.ch1_setpoint = info_file["Charge Exchange Default Setpoint"]
 
         if self.is_setpoint(setpoint2):
             self.ch2_setpoint = round(setpoint2,1)
         else:
-            self.ch2_setpoint = ch2_default_setpoint
+            self.ch2_setpoint = info_file["Detector Default Setpoint"]
 
         self.device.write("SP1,"+str(self.ch1_setpoint)+"\r")
         self.device.readline()
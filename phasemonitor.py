@@ -1,4 +1,4 @@
-from acquisition import Acquisition
+from acquisition import Acquisition, RecordBuffer
 from fosof_qol import Travisty
 import multiprocessing as mp
 import thread
@@ -40,8 +40,8 @@ except ImportError:
 # Binary Traces = bool
 # Notes = string
 
-independent_rd_location = qol.path_file['Run Queue'] + \
-                          'phase_monitor_DEFAULT.rd'
+# Run dictionary used when the acquisition is run on its own (see main)
+independent_rd_name = 'phase_monitor_DEFAULT.rd'
 
 class PhaseMonitor(Acquisition):
 
@@ -133,6 +133,10 @@ class PhaseMonitor(Acquisition):
         self.max_avg = int(self.run_dictionary \
                                .ix['Number of Traces per Loop'].Value)
 
+        # Capture all traces of a loop in one acquisition, one record each
+        if self.max_avg > 1:
+            self.digi.set_numrecords(self.max_avg)
+
         self.fc = faradaycupclass.FaradayCup()
 
         self.progress = 'Setting up data table'
@@ -164,10 +168,14 @@ class PhaseMonitor(Acquisition):
             cols.append(qol.formatted_quench_name(q) + \
                        ' Attenuator Voltage Reading [V]')
 
-        self.data = pd.DataFrame(columns = cols)
-        self.data.set_index(['Repeat','Average']).to_csv(data_file)
+        self.data = RecordBuffer(cols, dtypes = {'Repeat' : int,
+                                                 'Average' : int})
+        self.data.write_header(data_file)
         data_file.close()
         print('\t'.join(self.data.columns))
+        self.data.open_sidecar(self.folder + qol.DATA_COLUMNS_FOLDER,
+                               run_dictionary = self.run_dictionary['Value'] \
+                                                    .to_dict())
 
         self.rep = 0
         self.avg = 0
@@ -180,17 +188,26 @@ class PhaseMonitor(Acquisition):
 
     def acquire(self):
 
+        # All traces of the loop are captured and read in one go. Each row
+        # is one trace.
+        self.progress = 'Loop ' + str(self.rep) + '\nAcquiring traces'
+        # Only the fit results are computed from the digitizer data, not the
+        # traces in volts.
+        R = self.digi.ini_read_reduce(reducers = ('mean', 'fourier'),
+                                      freqs = [self.offset_freq])
+        print(self.digi_channel_i,self.digi_channel_r)
+        A_i = np.atleast_2d(R[self.digi_channel_i]['amplitude'])[:,0]
+        phi_i = np.atleast_2d(R[self.digi_channel_i]['phase'])[:,0]
+        dc_i = np.atleast_1d(R[self.digi_channel_i]['mean'])
+        A_r = np.atleast_2d(R[self.digi_channel_r]['amplitude'])[:,0]
+        phi_r = np.atleast_2d(R[self.digi_channel_r]['phase'])[:,0]
+        dc_r = np.atleast_1d(R[self.digi_channel_r]['mean'])
+
         while self.avg < self.max_avg:
             self.progress = 'Loop ' + str(self.rep) + '\nTrace ' + str(self.avg)
-            V = self.digi.ini_read(channel = None, read_type = 'FLOAT', ret_bin = False)
-            print(self.digi_channel_i,self.digi_channel_r)
 
-            a_i, phi_i, dc_i = qol.fit(V[self.digi_channel_i],
-                                       1./self.sampling_rate, self.offset_freq)
-            a_r, phi_r, dc_r = qol.fit(V[self.digi_channel_r],
-                                       1./self.sampling_rate, self.offset_freq)
-
-            phase_diff = (phi_r - phi_i + 2.*np.pi) % (2.*np.pi)
+            phase_diff = (phi_r[self.avg] - phi_i[self.avg] + 2.*np.pi) % \
+                         (2.*np.pi)
 
             fcup_currents = np.array(self.fc.get_current("all"))
 
@@ -199,37 +216,29 @@ class PhaseMonitor(Acquisition):
             wg_power_a = self.gen.get_wg_power('A')
             wg_power_b = self.gen.get_wg_power('B')
 
-            data_to_append = np.array([self.rep+1,
-                                       self.avg+1,
-                                       a_i,
-                                       dc_i,
-                                       a_r,
-                                       dc_r,
-                                       phase_diff,
-                                       wg_power_a,
-                                       wg_power_b,
-                                       time.time()])
+            data_to_append = [self.rep+1,
+                              self.avg+1,
+                              A_i[self.avg],
+                              dc_i[self.avg],
+                              A_r[self.avg],
+                              dc_r[self.avg],
+                              phase_diff,
+                              wg_power_a,
+                              wg_power_b,
+                              time.time()]
 
-            data_to_append = np.append(data_to_append, fcup_currents)
+            data_to_append += list(fcup_currents)
 
             for quench_index in self.open_quenches:
-                this_quench = [powers[quench_index],
-                               atten_vs_read[quench_index]]
-                data_to_append = np.append(data_to_append, this_quench)
+                data_to_append += [powers[quench_index],
+                                   atten_vs_read[quench_index]]
 
             sys.stdout.write('\t'.join(list(map(str,data_to_append))))
-            self.data = self.data.append(pd.Series(data_to_append,
-                                                   name = len(self.data),
-                                                   index = self.data.columns
-                                                  )
-                                        )
+            self.data.append(data_to_append)
 
             self.avg += 1
 
-        data_file = open(self.folder + 'data.txt', 'a')
-        self.data_out = self.data.iloc[-self.max_avg:].set_index(['Repeat', 'Average'])
-        self.data_out.to_csv(data_file, header = False)
-        data_file.close()
+        self.data.flush_to(self.folder + 'data.txt')
         self.rep += 1
         self.avg = 0
 
@@ -262,6 +271,8 @@ class PhaseMonitor(Acquisition):
                                         ch2_range = self.ch_range,
                                         sampling_rate = self.sampling_rate,
                                         num_samples = self.num_samples)
+        if self.max_avg > 1:
+            self.digi.set_numrecords(self.max_avg)
 
         self.progress = 'Opening generator'
 
@@ -322,7 +333,7 @@ def main():
     queue_out = mp.queues.Queue()
     queue_err = mp.queues.Queue()
 
-    queue_in.put(independent_rd_location)
+    queue_in.put(qol.path_file['Run Queue'] + independent_rd_name)
 
     acq = PhaseMonitor(queue_in, queue_out, queue_err)
 
@@ -9,12 +9,17 @@ import struct
 import time
 from LabJackPython import LabJackException
 import traceback as tb
+import devicedata
 
-_DEFAULT_FILE_LOCATION = "C:/DEVICEDATA/"
 _SLEEP_TIME = 0.01
 
-quench_info = pd.read_csv(_DEFAULT_FILE_LOCATION + "quench.csv") \
-                .set_index("Cavity")
+def get_quench_info():
+    ''' Returns the hardware data for the quenches from quench.csv, indexed by
+    cavity. The table is read on first use and shared, so it must not be
+    modified.
+    '''
+
+    return devicedata.get_table("quench", index_col = "Cavity")
 
 def isfreq(f):
     '''
@@ -136,7 +141,8 @@ class Quench(object):
         self.ain_pin = ain_pin # AIN Pin for reading power detector
         self.freq = freq # Frequency (MHz)
         self.cavity = cavity # Cavity name
-        self.pi_pulse = quench_info['LJDAC Pi Pulse Voltage [V]'].ix[cavity]
+        self.pi_pulse = get_quench_info()['LJDAC Pi Pulse Voltage [V]'] \
+                            .ix[cavity]
         self.com_port = com_port
 
         # Check arguments to see if options are special
@@ -166,11 +172,12 @@ class Quench(object):
             except TypeError as err:
                 print("The value entered for atten_v was not a float.")
                 print("Cavity will be set to pi pulse.")
-                self.atten_v = quench_info['LJDAC Pi Pulse Voltage [V]'] \
-                                          .ix[self.cavity]
+                self.atten_v = get_quench_info() \
+                                   ['LJDAC Pi Pulse Voltage [V]'] \
+                                   .ix[self.cavity]
         else:
-            self.atten_v = quench_info['LJDAC Pi Pulse Voltage [V]'] \
-                                        .ix[self.cavity]
+            self.atten_v = get_quench_info()['LJDAC Pi Pulse Voltage [V]'] \
+                                            .ix[self.cavity]
 
         # If no LabJack U3 handle is specified, a new instance will be opened.
         # This will prevent any other quenches from opening this u3.
@@ -556,8 +563,9 @@ class QuenchManager(object):
         LabJacks cannot be opened from more than one Python kernel at a time.
         '''
 
-        # Open quench information file.
-        self.quench_info = quench_info
+        # Open quench information file. This instance adds its own columns,
+        # so it works on a copy of the shared table.
+        self.quench_info = get_quench_info().copy()
         num_quenches = len(self.quench_info.index)
 
         # Create new columns specifically for this instance of a QuenchManager.
@@ -7,7 +7,7 @@ import digitizer
 import quench
 import generator
 from datetime import datetime as dt
-from acquisition import Acquisition
+from acquisition import Acquisition, RecordBuffer
 import traceback as tb
 import sys
 
@@ -28,8 +28,8 @@ import sys
 # Quench Cavity to Scan = cavity name (see Manager docs)
 # Binary Traces = bool
 
-independent_rd_location = qol.path_file['Run Queue'] + \
-                          'quench_calibration_DEFAULT.rd'
+# Run dictionary used when the acquisition is run on its own (see main)
+independent_rd_name = 'quench_calibration_DEFAULT.rd'
 
 class QuenchCalibration(Acquisition):
 
@@ -139,10 +139,12 @@ class QuenchCalibration(Acquisition):
                         ' Attenuator Voltage Reading (Quenches Off) [V]')
 
         # Write column headers
-        self.data = pd.DataFrame(columns = cols)
-        data_file = open(self.folder + 'data.txt', 'a')
-        self.data.to_csv(data_file, index=False)
-        data_file.close()
+        self.data = RecordBuffer(cols, dtypes = {'Repeat' : int,
+                                                 'Average' : int})
+        self.data.write_header(self.folder + 'data.txt')
+        self.data.open_sidecar(self.folder + qol.DATA_COLUMNS_FOLDER,
+                               run_dictionary = self.run_dictionary['Value'] \
+                                                    .to_dict())
         print('\t'.join(self.data.columns))
 
         self.rep = 0
@@ -175,13 +177,11 @@ class QuenchCalibration(Acquisition):
 
             self.qm.cavities_on(self.on_quenches)
 
-            V = self.digi.ini_read(channel = self.digi_channel, \
-                                   read_type = 'FLOAT', \
-                                   ret_bin = False)
-            V = V[0]
+            R, err = self.digi.ini_read_reduce(reducers = ('mean', 'std'),
+                                               channel = self.digi_channel)
 
-            dc_on_avg = np.mean(V)
-            dc_on_std = np.std(V)
+            dc_on_avg = R['mean']
+            dc_on_std = R['std']
 
             atten_vs_read_on = self.qm.get_dac_voltages(self.open_quenches)
             powers_on = self.qm.get_cavity_powers(self.open_quenches)
@@ -189,13 +189,11 @@ class QuenchCalibration(Acquisition):
 
             self.qm.cavities_off(self.on_quenches)
 
-            V = self.digi.ini_read(channel = self.digi_channel, \
-                                   read_type = 'FLOAT', \
-                                   ret_bin = False)
-            V = V[0]
+            R, err = self.digi.ini_read_reduce(reducers = ('mean', 'std'),
+                                               channel = self.digi_channel)
 
-            dc_off_avg = np.mean(V)
-            dc_off_std = np.std(V)
+            dc_off_avg = R['mean']
+            dc_off_std = R['std']
 
             atten_vs_read_off = self.qm.get_dac_voltages(self.open_quenches)
             powers_off = self.qm.get_cavity_powers(self.open_quenches)
@@ -203,37 +201,26 @@ class QuenchCalibration(Acquisition):
 
             on_off_ratio = dc_on_avg / dc_off_avg
 
-            data_to_append = np.array([int(self.rep)+1, \
-                                       int(self.avg)+1, \
-                                       atten_v, \
-                                       dc_on_avg, \
-                                       dc_on_std, \
-                                       dc_off_avg, \
-                                       dc_off_std, \
-                                       on_off_ratio, \
-                                       time.time()])
+            data_to_append = [int(self.rep)+1, \
+                              int(self.avg)+1, \
+                              atten_v, \
+                              dc_on_avg, \
+                              dc_on_std, \
+                              dc_off_avg, \
+                              dc_off_std, \
+                              on_off_ratio, \
+                              time.time()]
             for quench_index in self.open_quenches:
-                this_quench = [powers_on[quench_index], \
-                               atten_vs_read_on[quench_index], \
-                               powers_off[quench_index], \
-                               atten_vs_read_off[quench_index]]
-                data_to_append = np.append(data_to_append, this_quench)
+                data_to_append += [powers_on[quench_index], \
+                                   atten_vs_read_on[quench_index], \
+                                   powers_off[quench_index], \
+                                   atten_vs_read_off[quench_index]]
 
             print('\t'.join(list(map(str,data_to_append))))
-            self.data = self.data.append(pd.Series(data_to_append, \
-                                                   name = len(self.data), \
-                                                   index = self.data.columns
-                                                   )
-                                        )
+            self.data.append(data_to_append)
             self.avg += 1
 
-        data_file = open(self.folder + 'data.txt', 'a')
-        data_out = self.data.iloc[-self.max_avg:] \
-                            .set_index(['Repeat', \
-                                        'Average', \
-                                        'Attenuator Voltage Setting [V]'])
-        data_out.to_csv(data_file, header = False)
-        data_file.close()
+        self.data.flush_to(self.folder + 'data.txt')
 
         self.avg = 0
         self.atten_v_iterator += 1
@@ -363,7 +350,7 @@ def main():
     queue_out = mp.queues.Queue()
     queue_err = mp.queues.Queue()
 
-    queue_in.put(independent_rd_location)
+    queue_in.put(qol.path_file['Run Queue'] + independent_rd_name)
 
     acq = PhaseMonitor(queue_in, queue_out, queue_err)
 
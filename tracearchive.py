@@ -0,0 +1,493 @@
+''' A single file archive of digitizer traces. Saving every trace to its own
+.npy file leaves hundreds of thousands of small files per run, which the file
+system and the Google Drive client handle badly. An archive is one file that
+traces are appended to, one after another:
+
+    FOSOFTRC                    8 byte file header
+    record header, trace        first trace
+    record header, trace        second trace
+    ...
+
+The record header (see RECORD_DTYPE) holds the trace name, as written in
+data.txt, and the settings the trace was taken with. The trace follows as
+16-bit little-endian integers straight from the digitizer, or compressed with
+one of the CODECS. A trace that was cut short by a crash is ignored when the
+archive is read.
+
+Use TraceWriter to write an archive, or AsyncTraceWriter to write it from a
+separate thread, and TraceArchive to read one. The reader memory-maps the file,
+so traces are only loaded from disk when used.
+'''
+import os
+import sys
+import time
+import zlib
+import threading
+import traceback as tb
+import numpy as np
+
+try:
+    from queue import Queue, Full
+except ImportError:
+    from Queue import Queue, Full
+
+_FILE_MAGIC_ = "FOSOFTRC"
+_RECORD_MAGIC_ = "TRC1"
+
+# Header written before every trace. 'channel' is the number at the end of the
+# trace name (1 to 4 in FOSOF) and 'pre910' is 'on', 'off' or '' if the 910
+# cavity is not switched. 'codec' is how the trace is stored ('' for raw) and
+# 'nbytes' is the length of the stored trace that follows. The spare bytes pad
+# the header to 128 bytes, so raw traces stay aligned.
+RECORD_DTYPE = np.dtype([('magic', 'S4'),
+                         ('name', 'S64'),
+                         ('rep', '<i4'),
+                         ('avg', '<i4'),
+                         ('freq', '<f8'),
+                         ('b_x', '<f8'),
+                         ('b_y', '<f8'),
+                         ('offset_freq', '<f8'),
+                         ('config', 'S1'),
+                         ('pre910', 'S3'),
+                         ('channel', '<i2'),
+                         ('codec', 'S4'),
+                         ('spare', 'S2'),
+                         ('nbytes', '<i8')])
+
+# Columns of TraceArchive.index
+_INDEX_FIELDS_ = [f for f in RECORD_DTYPE.names if not f in ['magic', 'spare']]
+INDEX_DTYPE = np.dtype([(f, RECORD_DTYPE[f]) for f in _INDEX_FIELDS_] + \
+                       [('offset', '<i8')])
+
+class Travisty(Exception):
+    def __init__(self, msg):
+        self.message = msg
+
+# Ways to store traces. 'raw' writes the samples as they are. 'zlib' is
+# lossless: it stores the differences between consecutive samples, which are
+# small for our traces, with the low bytes of all samples first and the high
+# bytes (mostly 0x00 or 0xff) after, and compresses that with zlib.
+CODECS = ['raw', 'zlib']
+
+def encode(V, codec = 'raw'):
+    ''' Returns the bytes stored for the 16-bit trace V.'''
+
+    V = np.ascontiguousarray(V, dtype = np.dtype('<i2'))
+
+    if codec == 'raw':
+        return V.tostring()
+    elif codec == 'zlib':
+        # Differences wrap around like the int16 sums in decode, so any trace
+        # is restored exactly
+        D = np.empty_like(V)
+        D[:1] = V[:1]
+        np.subtract(V[1:], V[:-1], out = D[1:])
+
+        # Byte shuffle
+        D = D.view(np.uint8).reshape((-1, 2)).T
+
+        return zlib.compress(D.tostring(), 1)
+    else:
+        raise Travisty("Oops! Unknown codec " + str(codec) + ". Must be " + \
+                       " or ".join(CODECS) + ".")
+
+def decode(data, codec = 'raw'):
+    ''' Returns the 16-bit trace stored as data by encode. A raw trace is a
+    view of data.
+    '''
+
+    if codec in ['raw', '']:
+        return np.frombuffer(data, dtype = np.dtype('<i2'))
+    elif codec == 'zlib':
+        D = np.frombuffer(zlib.decompress(data), dtype = np.uint8)
+        D = np.ascontiguousarray(D.reshape((2, -1)).T).view(np.dtype('<i2'))
+
+        return np.cumsum(D[:,0], dtype = np.dtype('<i2'))
+    else:
+        raise Travisty("Oops! Unknown codec " + str(codec) + ". Must be " + \
+                       " or ".join(CODECS) + ".")
+
+def benchmark_codec(codec = 'zlib', num_samples = 100000, num_traces = 20,
+                    sampling_rate = 100000, num_channels = 4, noise = 5.):
+    ''' Encodes and decodes num_traces simulated traces (a sine wave using a
+    small part of the ADC range, like our detector and combiner traces, plus
+    noise ADC codes rms) and prints the speeds and the compression ratio. The
+    encode speed is compared to the rate the acquisition produces data at:
+    num_channels channels at sampling_rate samples per second. Returns a dict
+    of the results.
+
+    The ratio depends mostly on the noise. With zlib it is about 2.3 for 2
+    codes rms, 2.1 for 5 and 1.8 for 20.
+    '''
+
+    t = np.arange(num_samples) / float(sampling_rate)
+    traces = []
+    for i in range(num_traces):
+        V = 2000. * np.cos(2. * np.pi * 625. * t + i) + 300. + \
+            noise * np.random.randn(num_samples)
+        traces.append(np.round(V).astype(np.dtype('<i2')))
+
+    t_s = time.time()
+    stored = [encode(V, codec = codec) for V in traces]
+    t_encode = time.time() - t_s
+
+    t_s = time.time()
+    restored = [decode(data, codec = codec) for data in stored]
+    t_decode = time.time() - t_s
+
+    for V, W in zip(traces, restored):
+        if not np.array_equal(V, W):
+            raise Travisty("Oops! The " + codec + " codec is not lossless.")
+
+    mb = num_traces * num_samples * 2 / 1e6
+    acq_rate = num_channels * sampling_rate * 2 / 1e6
+
+    results = {'encode [MB/s]' : mb / max(t_encode, 1e-9),
+               'decode [MB/s]' : mb / max(t_decode, 1e-9),
+               'acquisition [MB/s]' : acq_rate,
+               'ratio' : mb * 1e6 / sum(len(data) for data in stored)}
+
+    print("Codec: " + codec)
+    print("Encode speed [MB/s]: " + str(results['encode [MB/s]']))
+    print("Decode speed [MB/s]: " + str(results['decode [MB/s]']))
+    print("Acquisition data rate [MB/s]: " + str(acq_rate))
+    print("Compression ratio: " + str(results['ratio']))
+
+    return results
+
+class TraceWriter(object):
+    ''' Appends traces to an archive file. The file is created if it does not
+    exist. Every trace is written with one sequential append.
+    '''
+
+    def __init__(self, path, codec = 'raw', buffer_size = 2**20):
+        if not codec in CODECS:
+            raise Travisty("Oops! Unknown codec " + str(codec) + \
+                           ". Must be " + " or ".join(CODECS) + ".")
+
+        self.path = path
+        self.codec = codec
+        self.file = open(path, 'ab', buffer_size)
+
+        if self.file.tell() == 0:
+            self.file.write(_FILE_MAGIC_)
+
+        self.num_written = 0
+
+    def append(self, V, name = '', rep = 0, avg = 0, freq = np.nan,
+               b_x = np.nan, b_y = np.nan, offset_freq = np.nan, config = '',
+               pre910 = '', channel = 0):
+        ''' Writes the trace V (any array of 16-bit integers, e.g. a channel
+        view from digitizer.deinterleave) with its settings, encoded with the
+        writer's codec. Returns the position of the trace in the file.
+        '''
+
+        data = encode(V, codec = self.codec)
+
+        header = np.zeros(1, dtype = RECORD_DTYPE)
+        header['magic'] = _RECORD_MAGIC_
+        header['name'] = name
+        header['rep'] = rep
+        header['avg'] = avg
+        header['freq'] = freq
+        header['b_x'] = b_x
+        header['b_y'] = b_y
+        header['offset_freq'] = offset_freq
+        header['config'] = config
+        header['pre910'] = pre910
+        header['channel'] = channel
+        if self.codec != 'raw':
+            header['codec'] = self.codec
+        header['nbytes'] = len(data)
+
+        offset = self.file.tell() + RECORD_DTYPE.itemsize
+        self.file.write(header.tostring() + data)
+        self.num_written += 1
+
+        return offset
+
+    def flush(self, sync = False):
+        ''' Writes the buffered traces to the file. If sync is True, also
+        waits until they are on the disk.
+        '''
+
+        self.file.flush()
+        if sync:
+            os.fsync(self.file.fileno())
+
+    def close(self):
+        if not self.file.closed:
+            self.flush(sync = True)
+            self.file.close()
+
+def read_index(path, start = None, size = None):
+    ''' Reads the record headers of an archive from byte start (the first
+    record if None) up to byte size (the end of the file if None), without
+    mapping the whole file. Stops at the first record that is incomplete.
+    Returns the index of the records read (see INDEX_DTYPE) and the position
+    of the next record, where a later call can carry on once more has been
+    written.
+    '''
+
+    if size is None:
+        size = os.path.getsize(path)
+
+    rows = []
+    with open(path, 'rb') as trc:
+        if start is None:
+            magic = trc.read(len(_FILE_MAGIC_))
+            if magic not in ["", _FILE_MAGIC_]:
+                raise Travisty("Oops! " + path + " is not a trace archive.")
+            start = len(_FILE_MAGIC_)
+
+        pos = start
+        while pos + RECORD_DTYPE.itemsize <= size:
+            trc.seek(pos)
+            header = np.frombuffer(trc.read(RECORD_DTYPE.itemsize),
+                                   dtype = RECORD_DTYPE)[0]
+
+            if header['magic'] != _RECORD_MAGIC_:
+                raise Travisty("Oops! Corrupt record at byte " + str(pos) + \
+                               " of " + path + ".")
+
+            offset = pos + RECORD_DTYPE.itemsize
+            if offset + header['nbytes'] > size:
+                break
+
+            rows.append(tuple(header[f] for f in _INDEX_FIELDS_) + (offset,))
+            pos = offset + header['nbytes']
+
+    return np.array(rows, dtype = INDEX_DTYPE), pos
+
+def read_trace(f, offset, nbytes, codec = ''):
+    ''' Reads one trace from an archive opened as the file f, given its
+    offset, nbytes and codec from the index.
+    '''
+
+    f.seek(offset)
+    return decode(f.read(nbytes), codec = codec)
+
+class TraceArchive(object):
+    ''' Reads an archive written by TraceWriter. The index is a structured
+    array with one row per trace (see INDEX_DTYPE) and traces can be looked up
+    by position or by name, e.g. archive['r001a001f910.0000chA_01'].
+    '''
+
+    def __init__(self, path):
+        self.path = path
+
+        if os.path.getsize(path) <= len(_FILE_MAGIC_):
+            self.data = np.zeros(0, dtype = np.uint8)
+        else:
+            self.data = np.memmap(path, dtype = np.uint8, mode = 'r')
+
+        if self.data[:len(_FILE_MAGIC_)].tostring() not in ["", _FILE_MAGIC_]:
+            raise Travisty("Oops! " + path + " is not a trace archive.")
+
+        self.index, self.end = read_index(path, size = len(self.data))
+        self._names = dict((name, i) for i, name \
+                           in enumerate(self.index['name']))
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            if not key in self._names:
+                raise KeyError(key)
+            key = self._names[key]
+
+        return self.trace(key)
+
+    def trace(self, i):
+        ''' Returns trace number i as an array of 16-bit integers. A raw trace
+        is read from the file when used. A compressed one is decoded now.
+        '''
+
+        row = self.index[i]
+
+        if row['codec'] == '':
+            return np.frombuffer(self.data, dtype = np.dtype('<i2'),
+                                 count = row['nbytes'] // 2,
+                                 offset = row['offset'])
+
+        data = self.data[row['offset']:row['offset'] + row['nbytes']]
+        return decode(data.tostring(), codec = row['codec'])
+
+    def find(self, **fields):
+        ''' Returns the positions of the traces whose settings match all the
+        given fields, e.g. find(rep = 1, config = 'A', channel = 1).
+        '''
+
+        mask = np.ones(len(self.index), dtype = bool)
+        for field in fields:
+            mask &= self.index[field] == fields[field]
+
+        return np.nonzero(mask)[0]
+
+    def close(self):
+        ''' Releases the memory map.'''
+
+        self.data = None
+
+class AsyncTraceWriter(object):
+    ''' Writes traces to an archive on a separate thread, so a slow disk does
+    not hold up the acquisition. append copies the trace and puts it in a
+    queue of at most max_queue traces. If the queue is full, append warns on
+    stderr and waits for room, so traces are only dropped if writing fails.
+    Traces are also encoded (see CODECS) on the writer thread.
+
+    The file is flushed whenever the queue empties, and synced to the disk
+    every sync_every traces or sync_interval seconds. See get_stats for the
+    queue depth and write latency.
+    '''
+
+    def __init__(self, path, codec = 'raw', max_queue = 64, sync_every = 64,
+                 sync_interval = 5.0):
+        self.writer = TraceWriter(path, codec = codec)
+        self.path = path
+        self.queue = Queue(max_queue)
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+
+        self._error = None
+
+        # Statistics (see get_stats)
+        self._lock = threading.Lock()
+        self._num_written = 0
+        self._num_synced = 0
+        self._num_dropped = 0
+        self._max_depth = 0
+        self._total_latency = 0.0
+        self._max_latency = 0.0
+        self._num_blocked = 0
+        self._time_blocked = 0.0
+
+        self.thread = threading.Thread(target = self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def append(self, V, **fields):
+        ''' Queues the trace V with its settings (see TraceWriter.append). V
+        is copied, so the buffer it is in can be reused right away.
+        '''
+
+        if self._error is not None:
+            raise Travisty("Oops! The trace writer failed: " + self._error)
+
+        item = (np.array(V, dtype = np.dtype('<i2')), fields, time.time())
+
+        try:
+            self.queue.put_nowait(item)
+        except Full:
+            sys.stderr.write("Trace writer is " + str(self.queue.qsize()) + \
+                             " traces behind. Waiting for the disk.\n")
+            t_s = time.time()
+            self.queue.put(item)
+            with self._lock:
+                self._num_blocked += 1
+                self._time_blocked += time.time() - t_s
+
+        with self._lock:
+            self._max_depth = max(self._max_depth, self.queue.qsize())
+
+    def _run(self):
+        ''' Writes queued traces until None is received.'''
+
+        num_unsynced = 0
+        t_sync = time.time()
+
+        while True:
+            item = self.queue.get()
+            written = False
+
+            try:
+                if item is None:
+                    break
+
+                V, fields, t_put = item
+
+                # After a failure, the remaining traces are only counted
+                if self._error is not None:
+                    with self._lock:
+                        self._num_dropped += 1
+                    continue
+
+                self.writer.append(V, **fields)
+                written = True
+                num_unsynced += 1
+
+                latency = time.time() - t_put
+                with self._lock:
+                    self._num_written += 1
+                    self._total_latency += latency
+                    self._max_latency = max(self._max_latency, latency)
+
+                if num_unsynced >= self.sync_every or \
+                   time.time() - t_sync >= self.sync_interval:
+                    self.writer.flush(sync = True)
+                    num_unsynced = 0
+                    t_sync = time.time()
+                elif self.queue.empty():
+                    self.writer.flush()
+
+                with self._lock:
+                    self._num_synced = self._num_written - num_unsynced
+            except Exception as e:
+                self._error = tb.format_exc()
+                sys.stderr.write(self._error)
+
+                if not written:
+                    with self._lock:
+                        self._num_dropped += 1
+            finally:
+                self.queue.task_done()
+
+    def get_stats(self):
+        ''' Returns a dict with the number of traces written and synced to the
+        disk, the number dropped because writing failed, the current and
+        largest queue depth, the mean and largest time [s] from append to
+        write, and how often and how long [s] append had to wait for the
+        writer.
+        '''
+
+        with self._lock:
+            n = self._num_written
+            return {'written' : n,
+                    'synced' : self._num_synced,
+                    'dropped' : self._num_dropped,
+                    'depth' : self.queue.qsize(),
+                    'max depth' : self._max_depth,
+                    'mean latency' : self._total_latency / max(n, 1),
+                    'max latency' : self._max_latency,
+                    'blocked' : self._num_blocked,
+                    'time blocked' : self._time_blocked}
+
+    def flush(self):
+        ''' Waits until all queued traces are written and synced to the
+        disk.
+        '''
+
+        self.queue.join()
+        self.writer.flush(sync = True)
+
+        if self._error is not None:
+            raise Travisty("Oops! The trace writer failed: " + self._error)
+
+        with self._lock:
+            self._num_synced = self._num_written
+
+    def close(self):
+        ''' Writes the remaining traces and closes the archive.'''
+
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+        self.writer.close()
+
+        if self._error is not None:
+            raise Travisty("Oops! The trace writer failed: " + self._error)
+
+        with self._lock:
+            self._num_synced = self._num_written
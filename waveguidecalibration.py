@@ -7,7 +7,7 @@ import digitizer
 import quench
 import generator
 from datetime import datetime as dt
-from acquisition import Acquisition
+from acquisition import Acquisition, RecordBuffer
 import traceback as tb
 
 # Run Dictionary Keys
@@ -30,8 +30,8 @@ import traceback as tb
 # Waveguide to Scan = A, B or BOTH
 # Binary Traces = bool
 
-independent_rd_location = qol.path_file['Run Queue'] + \
-                          'waveguide_calibration_DEFAULT.rd'
+# Run dictionary used when the acquisition is run on its own (see main)
+independent_rd_name = 'waveguide_calibration_DEFAULT.rd'
 
 class WaveguideCalibration(Acquisition):
 
@@ -159,10 +159,13 @@ class WaveguideCalibration(Acquisition):
                         ' Attenuator Voltage Reading (Generator Off) [V]')
 
         # Write column headers
-        self.data = pd.DataFrame(columns = cols)
-        data_file = open(self.folder + 'data.txt', 'a')
-        self.data.to_csv(data_file, index=False)
-        data_file.close()
+        self.data = RecordBuffer(cols, dtypes = {'Generator Channel' : object,
+                                                 'Repeat' : int,
+                                                 'Average' : int})
+        self.data.write_header(self.folder + 'data.txt')
+        self.data.open_sidecar(self.folder + qol.DATA_COLUMNS_FOLDER,
+                               run_dictionary = self.run_dictionary['Value'] \
+                                                    .to_dict())
         print('\t'.join(self.data.columns))
 
         self.rep = 0
@@ -229,13 +232,11 @@ class WaveguideCalibration(Acquisition):
             print(self.gen.get_rf_generator_power(wg))
             self.qm.cavities_on(self.on_quenches)
 
-            V = self.digi.ini_read(channel = self.digi_channel, \
-                                   read_type = 'FLOAT', \
-                                   ret_bin = False)
-            V = V[0]
+            R, err = self.digi.ini_read_reduce(reducers = ('mean', 'std'),
+                                               channel = self.digi_channel)
 
-            dc_on_avg = np.mean(V)
-            dc_on_std = np.std(V)
+            dc_on_avg = R['mean']
+            dc_on_std = R['std']
 
             atten_vs_read_on = self.qm.get_dac_voltages(self.open_quenches)
             powers_on = self.qm.get_cavity_powers(self.open_quenches)
@@ -248,13 +249,11 @@ class WaveguideCalibration(Acquisition):
             self.gen.power_low('B')
             self.qm.cavities_off(self.on_quenches)
 
-            V = self.digi.ini_read(channel = self.digi_channel, \
-                                   read_type = 'FLOAT', \
-                                   ret_bin = False)
-            V = V[0]
+            R, err = self.digi.ini_read_reduce(reducers = ('mean', 'std'),
+                                               channel = self.digi_channel)
 
-            dc_off_avg = np.mean(V)
-            dc_off_std = np.std(V)
+            dc_off_avg = R['mean']
+            dc_off_std = R['std']
 
             atten_vs_read_off = self.qm.get_dac_voltages(self.open_quenches)
             powers_off = self.qm.get_cavity_powers(self.open_quenches)
@@ -265,46 +264,33 @@ class WaveguideCalibration(Acquisition):
 
             on_off_ratio = dc_on_avg / dc_off_avg
 
-            data_to_append = np.array([wg,
-                                       int(self.rep)+1,
-                                       gen_f,
-                                       gen_p,
-                                       int(self.avg)+1,
-                                       wg_A_power_on,
-                                       wg_B_power_on,
-                                       wg_A_power_off,
-                                       wg_B_power_off,
-                                       dc_on_avg,
-                                       dc_on_std,
-                                       dc_off_avg,
-                                       dc_off_std,
-                                       on_off_ratio,
-                                       time.time()])
+            data_to_append = [wg,
+                              int(self.rep)+1,
+                              gen_f,
+                              gen_p,
+                              int(self.avg)+1,
+                              wg_A_power_on,
+                              wg_B_power_on,
+                              wg_A_power_off,
+                              wg_B_power_off,
+                              dc_on_avg,
+                              dc_on_std,
+                              dc_off_avg,
+                              dc_off_std,
+                              on_off_ratio,
+                              time.time()]
             for quench_index in self.open_quenches:
-                this_quench = [powers_on[quench_index],
-                               atten_vs_read_on[quench_index],
-                               powers_off[quench_index],
-                               atten_vs_read_off[quench_index]]
-                data_to_append = np.append(data_to_append, this_quench)
+                data_to_append += [powers_on[quench_index],
+                                   atten_vs_read_on[quench_index],
+                                   powers_off[quench_index],
+                                   atten_vs_read_off[quench_index]]
 
             print(len(self.data.columns))
             print('\t'.join(list(map(str,data_to_append))))
-            self.data = self.data.append(pd.Series(data_to_append,
-                                                   name = len(self.data),
-                                                   index = self.data.columns
-                                                   )
-                                        )
+            self.data.append(data_to_append)
             self.avg += 1
 
-        data_file = open(self.folder + 'data.txt', 'a')
-        data_out = self.data.iloc[-self.max_avg:] \
-                            .set_index(['Generator Channel',
-                                        'Repeat',
-                                        'Waveguide Frequency Setting [MHz]',
-                                        'Waveguide Power Setting [dBm]',
-                                        'Average'])
-        data_out.to_csv(data_file, header = False)
-        data_file.close()
+        self.data.flush_to(self.folder + 'data.txt')
 
         self.avg = 0
         self.gen_p_iterator += 1
@@ -410,7 +396,7 @@ def main():
     queue_out = mp.queues.Queue()
     queue_err = mp.queues.Queue()
 
-    queue_in.put(independent_rd_location)
+    queue_in.put(qol.path_file['Run Queue'] + independent_rd_name)
 
     acq = PhaseMonitor(queue_in, queue_out, queue_err)
 
@@ -13,13 +13,14 @@ import scipy.optimize as opt
 import matplotlib.pyplot as plt
 import os, sys
 import scipy.optimize as scopt
+import fosof_qol as qol
 
 #%matplotlib inline
 #%config InlineBackend.figure_format = 'svg'
 
 data_directory = "C:\\Google Drive\\data\\"
 dataset_directory = data_directory + "180108-100304 - Waveguide calibration - BOTH waveguides 4MHz Scan 0config-PD_OFF\\"
-data = pd.read_csv(dataset_directory + "data.txt", skiprows = 18)
+data, run_dictionary = qol.load_run(dataset_directory)
 
 print(data.columns)
 